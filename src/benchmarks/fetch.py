@@ -0,0 +1,89 @@
+"""
+Purpose: Benchmark the Epidata fetch path offline.
+
+A ReplayServer serves synthetic data (or a recording made with
+`neurips_main --record`) with the given latency and share of failing
+requests, and a FluDataSource caches the usual sensors and regions through
+it, exactly as neurips_main does against the Delphi API. Reports the wall time,
+the requests made, their latency and the injected errors, and saves them as
+JSON.
+
+Example:
+    python -m src.benchmarks.fetch out.json --latency 0.1 --error-rate 0.05 \
+        --concurrency 1,8
+"""
+
+# standard
+import itertools
+import json
+import logging
+import time
+
+# third party
+import click
+
+# first party
+from src.config import *
+from src.utils.delphi_epidata import Epidata
+from src.utils.epidata_replay import (RecordedResponses, ReplayServer,
+                                      SyntheticResponses)
+from src.utils.flu_data_source import FluDataSource
+from src.utils.metrics import metrics
+from src.utils.sim_helper import cache
+from src.utils.synthetic_data_source import SyntheticDataSource
+
+
+def benchmark(responses, concurrency, latency, error_rate, seed=SEED):
+    """Cache SENSORS in REGION_LIST through a ReplayServer once."""
+    metrics.drain()
+    with ReplayServer(responses, latency, error_rate, seed) as server:
+        inputs = list(itertools.product(SENSORS, REGION_LIST))
+        ds = FluDataSource(Epidata, SENSORS, inputs,
+                           max_concurrency=concurrency)
+        start = time.perf_counter()
+        cache(ds)
+        seconds = time.perf_counter() - start
+    return {"concurrency": concurrency, "latency": latency,
+            "error_rate": error_rate, "seconds": seconds,
+            "server": server.stats, "fetcher": ds.fetcher.summary(),
+            "counters": metrics.drain()["counters"]}
+
+
+def parse_ints(ctx, param, value):
+    return [int(v) for v in value.split(",")]
+
+
+@click.command()
+@click.argument('out', type=str)
+@click.option('--replay', type=str, default=None,
+              help='Serve this recording instead of synthetic data.')
+@click.option('--latency', type=float, default=0.05,
+              help='Seconds the server waits before every answer.')
+@click.option('--error-rate', type=float, default=0.0,
+              help='Share of requests answered with HTTP 503.')
+@click.option('--concurrency', default="1,8", callback=parse_ints,
+              help='Comma-separated concurrency limits to compare.')
+def main(out, replay, latency, error_rate, concurrency):
+    metrics.enabled = True
+    if replay is None:
+        responses = SyntheticResponses(
+            SyntheticDataSource(SENSORS, REGION_LIST, seed=SEED))
+    else:
+        responses = RecordedResponses(replay)
+
+    results = [benchmark(responses, c, latency, error_rate)
+               for c in concurrency]
+    with open(out, "w") as f:
+        json.dump(results, f, indent=1)
+
+    for result in results:
+        stats = result["fetcher"]
+        click.echo(f"concurrency {result['concurrency']:3d}: "
+                   f"{result['seconds']:7.2f}s, {stats['requests']} requests "
+                   f"({result['server']['errors']} failed and retried), "
+                   f"p95 latency {stats.get('p95', 0):.3f}s")
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.WARNING)
+    main()
@@ -0,0 +1,128 @@
+"""
+Purpose: Benchmark the whole neurips_main flow on offline synthetic data.
+
+A SyntheticDataSource takes the place of FluDataSource, so data assembly,
+statespace selection, cross-validation, prediction, random forests and result
+writing all run exactly as in a simulation, without Delphi access. Scenarios:
+
+  - public: the toy set-up in config.py (2 sensors, 5 states);
+  - private: all sensors and all states of the private set-up;
+  - county: the private geography with many more sensors per location. The
+    statespace is limited to FluView atoms, so county scale is approximated by
+    the size of the sensor set rather than by finer locations.
+
+Reports the time of every stage (from the run metrics), the peak worker memory
+of every task type and the throughput per week, and saves them as JSON.
+
+Example:
+    python -m src.benchmarks.simulation public 201745 201750 bench.json
+"""
+
+# standard
+import json
+import logging
+import os
+import tempfile
+
+# third party
+import click
+import numpy as np
+
+# first party
+from src import neurips_main
+from src.config import *
+from src.utils.epiweek import range_epiweeks
+from src.utils.flu_data_source import FluDataSource
+from src.utils.geo.locations import Locations
+from src.utils.metrics import metrics
+from src.utils.resources import ThreadBudget
+from src.utils.sim_helper import ResultFile, cache
+from src.utils.synthetic_data_source import SyntheticDataSource
+
+PRIVATE_EXCLUDE = ["pr", "vi"] + Locations.cen_list
+PRIVATE_REGIONS = [l for l in Locations.region_list
+                   if l not in PRIVATE_EXCLUDE]
+
+SCENARIOS = {
+    "public": {"sensors": SENSORS, "regions": REGION_LIST,
+               "atoms": ATOM_LIST, "exclude": EXCLUDE_LOC},
+    "private": {"sensors": FluDataSource.SENSORS, "regions": PRIVATE_REGIONS,
+                "atoms": [l for l in Locations.atom_list
+                          if l not in PRIVATE_EXCLUDE],
+                "exclude": PRIVATE_EXCLUDE},
+    "county": {"sensors": [f"sensor{i}" for i in range(40)],
+               "regions": PRIVATE_REGIONS,
+               "atoms": [l for l in Locations.atom_list
+                         if l not in PRIVATE_EXCLUDE],
+               "exclude": PRIVATE_EXCLUDE},
+}
+
+
+def benchmark(scenario, weeks, n_train_weeks=N_TRAIN_WEEKS, seed=SEED):
+    """Simulate the weeks on synthetic data, returning the measurements."""
+    spec = SCENARIOS[scenario]
+    excluded_atoms = [l for l in spec["exclude"] if l in Locations.atom_list]
+    with metrics.timer("synthesize"):
+        ds = SyntheticDataSource(spec["sensors"], spec["regions"],
+                                 exclude_locations=excluded_atoms, seed=seed)
+    with metrics.timer("cache"):
+        cache(ds, spec["sensors"], regions=spec["regions"])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = ResultFile(os.path.join(tmp, "bench.p"))
+        week_seconds = neurips_main.simulate(
+            weeks, ds, out_file, n_train_weeks=n_train_weeks,
+            regions=spec["regions"], sensors=spec["sensors"],
+            atoms=spec["atoms"], exclude=spec["exclude"])
+
+    stages = {name: {"calls": calls, "wall": wall, "cpu": cpu}
+              for name, (calls, wall, cpu) in metrics.timings.items()}
+    return {"scenario": scenario, "weeks": weeks,
+            "inputs": len(spec["sensors"]) * len(spec["regions"]),
+            "states": len(spec["atoms"]), "stages": stages,
+            "week_seconds": week_seconds,
+            "weeks_per_hour": 3600 * len(weeks) / sum(week_seconds),
+            "counters": dict(metrics.counters),
+            "peak_rss_mb": {name[len("rss."):]: value / 2 ** 20
+                            for name, value in metrics.peaks.items()
+                            if name.startswith("rss.")}}
+
+
+@click.command()
+@click.argument('scenario', type=click.Choice(list(SCENARIOS)))
+@click.argument('start', type=int)
+@click.argument('end', type=int)
+@click.argument('out', type=str)
+@click.option('--train-weeks', type=int, default=N_TRAIN_WEEKS,
+              help='Number of training weeks.')
+@click.option('--cores', type=int, default=N_CORES,
+              help='Total number of cores to use (default: all).')
+@click.option('--threads-per-task', type=int, default=THREADS_PER_TASK,
+              help='Threads per solver/BLAS/RF task.')
+def main(scenario, start, end, out, train_weeks, cores, threads_per_task):
+    np.random.seed(SEED)
+    metrics.enabled = True
+    neurips_main.start_pool(
+        ThreadBudget(cores, threads_per_task, max_workers=MAX_WORKERS))
+
+    result = benchmark(scenario, list(range_epiweeks(start, end)), train_weeks)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=1)
+
+    click.echo(f"{scenario}: {result['inputs']} inputs, {result['states']} "
+               f"states, {result['weeks_per_hour']:.1f} weeks/hour")
+    seconds = np.array(result["week_seconds"])
+    click.echo(f"per week: mean {seconds.mean():.2f}s, median "
+               f"{np.median(seconds):.2f}s, max {seconds.max():.2f}s")
+    for name, stage in sorted(result["stages"].items(),
+                              key=lambda item: -item[1]["wall"]):
+        click.echo(f"{name:>24} {stage['calls']:6d} calls {stage['wall']:9.3f}s"
+                   f" wall {stage['cpu']:9.3f}s cpu "
+                   f"{stage['wall'] / stage['calls'] * 1e3:9.2f}ms/call")
+    for name, mb in sorted(result["peak_rss_mb"].items()):
+        click.echo(f"{name:>24} peak worker RSS {mb:9.1f}MB")
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.WARNING)
+    main()
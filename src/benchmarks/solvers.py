@@ -0,0 +1,216 @@
+"""
+Purpose: Benchmark the regression/sensor fusion solvers on synthetic problems.
+
+Problems are generated like the checks at the bottom of sf.py and reg.py, at
+every combination of weeks (t), sensors (d), states (k) and lambda-grid size.
+Every method of every backend is timed, its memory is recorded and its
+solution is compared against a reference computed independently (closed form
+for the L2 methods, scikit-learn for lasso). Memory is the peak resident set
+size during the run, which includes Gurobi's native allocations; the peak is
+reset before every run (memory.py), so that runs are measured independently.
+
+Results are saved as JSON. Given the results of a previous version as
+baseline, runs that slowed down or needed more memory than the tolerance
+allows and solutions that lost accuracy are flagged, and the exit code is
+non-zero.
+
+Example:
+    python -m src.benchmarks.solvers out.json --weeks 52,156 --sensors 16,64 \
+        --baseline previous.json
+"""
+
+# standard
+import itertools
+import json
+import logging
+import time
+
+# third party
+import click
+import numpy as np
+
+# first party
+from src.models import reg, sf
+from src.models.gurobi_env import init_env
+from src.utils.memory import current_rss, peak_rss, reset_peak_rss
+from src.utils.metrics import metrics
+
+# solvers by backend, all with the signature method(X, Z, H, lams)
+BACKENDS = {
+    "gurobi": {"sf_l2": sf.sf_l2, "sf_l1": sf.sf_l1,
+               "ridge": reg.ridge, "lasso": reg.lasso},
+}
+
+
+def make_problem(t, d, k, seed=0):
+    """Return synthetic wILI X (t x k), sensors Z (t x d) and H (d x k)."""
+    rng = np.random.RandomState(seed)
+    H = np.abs(rng.randn(d, k))
+    H /= H.sum(axis=1, keepdims=True)  # rows are population weights
+    X = np.abs(rng.randn(t, k)) + 1
+    Z = X @ H.T + 0.1 * rng.randn(t, d)
+    return X, Z, H
+
+
+def make_lams(n):
+    """Return a grid of n penalties: zero, then log-spaced up to 10."""
+    return [0.] + list(np.exp(np.linspace(np.log(1e-3), np.log(10), n - 1)))
+
+
+def reference(method_key, X, Z, H, lam):
+    """Return an independently computed solution (d x k), or None."""
+    d, k = H.shape
+    if method_key == "ridge" or (method_key == "lasso" and lam == 0):
+        return np.linalg.solve(Z.T @ Z + lam * np.eye(d), Z.T @ X)
+    if method_key == "sf_l2" or (method_key == "sf_l1" and lam == 0):
+        # KKT system of min |X_j - Z b|^2 + lam |b|^2 s.t. H'b = e_j
+        kkt = np.block([[2 * (Z.T @ Z + lam * np.eye(d)), H],
+                        [H.T, np.zeros((k, k))]])
+        rhs = np.vstack([2 * Z.T @ X, np.eye(k)])
+        return np.linalg.solve(kkt, rhs)[:d]
+    if method_key == "lasso":
+        from sklearn.linear_model import Lasso  # loaded on first use
+        mod = Lasso(alpha=lam, fit_intercept=False, tol=1e-10,
+                    max_iter=10 ** 5)
+        return np.column_stack([mod.fit(Z, X[:, j]).coef_ for j in range(k)])
+    return None
+
+
+def measure(method, X, Z, H, lams):
+    """Run the method, returning its solution, time and memory usage.
+
+    Memory is the peak RSS during the run (`peak_rss_mb`) and how far it rose
+    above the RSS before the run (`rss_mb`); both are None where the peak
+    cannot be reset, since it would then cover earlier runs too.
+    """
+    metrics.drain()
+    reset = reset_peak_rss()
+    before = current_rss()
+    start = time.perf_counter()
+    Beta = method(X, Z, H, lams)
+    seconds = time.perf_counter() - start
+    peak = peak_rss()
+    solve = metrics.drain()["timings"].get("gurobi.optimize", [0, 0.0])[1]
+    record = {"seconds": seconds, "solve_seconds": solve,
+              "peak_rss_mb": None, "rss_mb": None}
+    if reset:
+        record.update(peak_rss_mb=peak / 2 ** 20,
+                      rss_mb=(peak - before) / 2 ** 20)
+    return Beta, record
+
+
+def run_benchmarks(weeks, sensors, states, grids, backends, methods, seed=0):
+    """Benchmark every configuration, returning one record per run."""
+    if "gurobi" in backends:
+        init_env()  # keep the one-time set-up out of the first run
+    records = []
+    configs = itertools.product(weeks, sensors, states, grids)
+    for t, d, k, n_lams in configs:
+        X, Z, H = make_problem(t, d, k, seed)
+        lams = make_lams(n_lams)
+        for backend, method_key in itertools.product(backends, methods):
+            if method_key not in BACKENDS[backend]:
+                continue
+            logging.info(f"{backend}/{method_key}: t={t} d={d} k={k} "
+                         f"lams={n_lams}")
+            Beta, record = measure(
+                BACKENDS[backend][method_key], X, Z, H, lams)
+
+            errors = []
+            for q, lam in enumerate(lams):
+                ref = reference(method_key, X, Z, H, lam)
+                if ref is not None:
+                    errors.append(np.max(np.abs(Beta[q] - ref)))
+            record.update(backend=backend, method=method_key, t=t, d=d, k=k,
+                          lams=n_lams,
+                          max_abs_error=max(errors) if errors else None)
+            records.append(record)
+    return records
+
+
+def compare(records, baseline, tolerance, atol, mem_atol):
+    """Return messages for runs that regressed against the baseline.
+
+    A run regressed if it took more than (1 + tolerance) times as long, used
+    more than (1 + tolerance) times as much memory, and at least mem_atol MB
+    more, or lost accuracy beyond atol.
+    """
+    key = lambda r: (r["backend"], r["method"], r["t"], r["d"], r["k"],
+                     r["lams"])
+    previous = {key(r): r for r in baseline}
+    flagged = []
+    for record in records:
+        old = previous.get(key(record))
+        if old is None:
+            continue
+        name = "{}/{} t={} d={} k={} lams={}".format(*key(record))
+        if record["seconds"] > (1 + tolerance) * old["seconds"]:
+            flagged.append(f"{name}: {old['seconds']:.3f}s -> "
+                           f"{record['seconds']:.3f}s")
+        rss, old_rss = record.get("rss_mb"), old.get("rss_mb")
+        if rss is not None and old_rss is not None and \
+                rss > max((1 + tolerance) * old_rss, old_rss + mem_atol):
+            flagged.append(f"{name}: memory {old_rss:.1f}MB -> {rss:.1f}MB")
+        error, old_error = record["max_abs_error"], old["max_abs_error"]
+        if error is not None and old_error is not None and \
+                error > max(old_error, atol):
+            flagged.append(f"{name}: error {old_error:.2e} -> {error:.2e}")
+    return flagged
+
+
+def parse_ints(ctx, param, value):
+    return [int(v) for v in value.split(",")]
+
+
+@click.command()
+@click.argument('out', type=str)
+@click.option('--weeks', default="52,156", callback=parse_ints,
+              help='Comma-separated numbers of training weeks (t).')
+@click.option('--sensors', default="16", callback=parse_ints,
+              help='Comma-separated numbers of sensors (d).')
+@click.option('--states', default="5", callback=parse_ints,
+              help='Comma-separated numbers of states (k).')
+@click.option('--lams', default="1,5", callback=parse_ints,
+              help='Comma-separated lambda-grid sizes.')
+@click.option('--backend', 'backends', multiple=True,
+              default=list(BACKENDS), help='Backends to run (repeatable).')
+@click.option('--method', 'methods', multiple=True,
+              default=["sf_l2", "sf_l1", "ridge", "lasso"],
+              help='Methods to run (repeatable).')
+@click.option('--baseline', type=str, default=None,
+              help='Results of a previous version to compare against.')
+@click.option('--tolerance', type=float, default=0.25,
+              help='Allowed relative slow-down or memory growth before a '
+                   'run is flagged.')
+@click.option('--atol', type=float, default=1e-4,
+              help='Solution error below which accuracy is not flagged.')
+@click.option('--mem-atol', type=float, default=8.0,
+              help='Memory growth in MB below which memory is not flagged.')
+def main(out, weeks, sensors, states, lams, backends, methods, baseline,
+         tolerance, atol, mem_atol):
+    metrics.enabled = True
+    records = run_benchmarks(weeks, sensors, states, lams, backends, methods)
+    with open(out, "w") as f:
+        json.dump(records, f, indent=1)
+
+    for r in records:
+        error = "n/a" if r["max_abs_error"] is None else \
+            f"{r['max_abs_error']:.1e}"
+        rss = "n/a" if r["rss_mb"] is None else f"+{r['rss_mb']:.1f}MB"
+        click.echo(f"{r['backend']:>8} {r['method']:>6} t={r['t']:<4} "
+                   f"d={r['d']:<4} k={r['k']:<3} lams={r['lams']:<3} "
+                   f"{r['seconds']:8.3f}s (solve {r['solve_seconds']:.3f}s) "
+                   f"{rss} error={error}")
+
+    if baseline is not None:
+        with open(baseline) as f:
+            flagged = compare(records, json.load(f), tolerance, atol,
+                              mem_atol)
+        for message in flagged:
+            logging.warning(f"Regression: {message}")
+        if flagged:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,15 @@ EXCLUDE_LOC = list(set(Locations.region_list) - set(REGION_LIST))
 # REGION_LIST = [l for l in Locations.region_list if l not in EXCLUDE_LOC]
 # -- [private] end --
 
+# fetched ILINet and sensor values are kept here across runs (None: no cache)
+CACHE_DIR = "cache"
+FETCH_CONCURRENCY = 8  # largest number of concurrent Epidata requests
+
+# out of core, the training history is memory-mapped from files here (None:
+# in memory) and assembled in chunks of at most HISTORY_CHUNK_MB
+HISTORY_DIR = None
+HISTORY_CHUNK_MB = 64
+
 # cross-validation
 N_CV_TIMEPOINTS = 10
 RIDGE_PARAMS = list(np.exp(np.linspace(np.log(10), np.log(300), 20)))
@@ -45,5 +54,11 @@ LASSO_PARAMS = list(sorted(LASSO_PARAMS))
 # random forest parameters
 N_ESTIMATORS = 200
 
+# parallelism (see utils/resources.py)
+N_CORES = None  # None uses all cores
+THREADS_PER_TASK = None  # None spreads the cores evenly over the workers
+MAX_WORKERS = None  # None allows one worker per core
+MEMORY_BUDGET_MB = None  # None runs as many tasks as there are workers
+
 # logging
 logging.basicConfig(level=logging.INFO)
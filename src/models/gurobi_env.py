@@ -0,0 +1,62 @@
+"""
+Keeps reusable Gurobi environments.
+
+Every `Model()` built on the default environment repeats the license check and
+solver set-up. Instead, each thread of each process keeps one environment,
+which is started once (by the pool worker initializer, or on first use) and
+shared by all models created afterwards. The environment is where the solver
+output and thread count are set: models inherit both from it. Environments
+are released when their process exits.
+"""
+
+# standard
+import logging
+import threading
+import time
+
+# first party
+from src.utils.resources import get_budget
+
+# environments of this process, by thread id
+_envs = {}
+_lock = threading.Lock()
+
+# total time spent starting environments in this process (seconds)
+_setup_time = 0.0
+
+
+def _start_env():
+    """Start a quiet environment limited to the current thread budget."""
+    from gurobipy import Env  # loaded on first use
+
+    env = Env(empty=True)
+    env.setParam('OutputFlag', 0)
+    env.setParam('Threads', get_budget().solver_threads)
+    env.start()
+    return env
+
+
+def get_env():
+    """Return the environment of the current thread, starting it if needed."""
+    global _setup_time
+    key = threading.get_ident()
+    env = _envs.get(key)
+    if env is None:
+        start = time.perf_counter()
+        env = _start_env()
+        with _lock:
+            _setup_time += time.perf_counter() - start
+            _envs[key] = env
+    return env
+
+
+def init_env():
+    """Start the environment of the calling thread (for pool initializers)."""
+    get_env()
+    logging.debug(f"Gurobi environment ready after {_setup_time:.3f}s.")
+
+
+def get_setup_time():
+    """Return the total time spent starting environments in this process."""
+    return _setup_time
+
@@ -3,12 +3,17 @@ Contains (unconstrained) regression methods.
 
 We use the python interface to the Gurobi solver. To speed up computation time
 for a grid of parameters, we reset the Gurobi model to an unsolved state (rather
-than reconstruct a new model).
+than reconstruct a new model). Models are built on the pooled environment of
+the calling process (see gurobi_env.py). Gurobi is only imported once a
+solver is called, which keeps the import of this module cheap.
 """
 
 # third party
 import numpy as np
-from gurobipy import *
+
+# first party
+from src.models.gurobi_env import get_env
+from src.utils.metrics import metrics
 
 
 def ridge(X, Z, H, lams):
@@ -23,13 +28,14 @@ def ridge(X, Z, H, lams):
     Returns:
         Beta: matrix of solutions to the minimization problem
     """
+    from gurobipy import GRB, Model, quicksum  # loaded on first use
+
     t, k = X.shape  # weeks x states
     d = Z.shape[1]  # num sensors
     Beta = np.zeros((len(lams), d, k)) * np.nan
 
     # Set up Gurobi model
-    m = Model()
-    m.setParam('OutputFlag', False)
+    m = Model(env=get_env())  # quiet, within the thread budget
     Bj = [m.addVar(lb=-GRB.INFINITY) for _ in range(d)]  # Beta_j
     G = [m.addVar(lb=-GRB.INFINITY) for _ in range(t)]  # G = X_j-ZBeta_j
     m.update()
@@ -54,7 +60,8 @@ def ridge(X, Z, H, lams):
                            lam * quicksum([Bj[j] * Bj[j] for j in range(d)]),
                            GRB.MINIMIZE)
             m.update()
-            m.optimize()
+            with metrics.timer('gurobi.optimize'):
+                m.optimize()
 
             Beta[q, :, region] = [Bj[i].X for i in range(d)]
             m.reset()  # reset model to unsolved state
@@ -74,13 +81,14 @@ def lasso(X, Z, H, lams):
         Returns:
             Beta: matrix of solutions to the minimization problem
         """
+    from gurobipy import GRB, Model, abs_, quicksum  # loaded on first use
+
     t, k = X.shape  # weeks x states
     d = Z.shape[1]  # num sensors
     Beta = np.zeros((len(lams), d, k)) * np.nan
 
     # Set up Gurobi model
-    m = Model()
-    m.setParam('OutputFlag', False)
+    m = Model(env=get_env())  # quiet, within the thread budget
     Bj = [m.addVar(lb=-GRB.INFINITY) for _ in range(d)]  # Beta_j
     aBj = [m.addVar(lb=0) for _ in range(d)]  # lasso variable
     G = [m.addVar(lb=-GRB.INFINITY) for _ in range(t)]  # G = X_j-ZBeta_j
@@ -108,7 +116,8 @@ def lasso(X, Z, H, lams):
                 [G[i] * G[i] for i in range(t)]) + lam * quicksum(
                 [aBj[j] for j in range(d)]), GRB.MINIMIZE)
             m.update()
-            m.optimize()
+            with metrics.timer('gurobi.optimize'):
+                m.optimize()
 
             Beta[q, :, region] = [Bj[i].X for i in range(d)]
             m.reset()  # reset model to unsolved state
@@ -7,49 +7,109 @@ and Insights
 
 # standard
 import datetime
-from multiprocessing import Pool, cpu_count
+import functools
+import importlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+START_TIME = time.perf_counter()  # reported by --profile-startup
 
 # third party
 import click
-from sklearn.ensemble import RandomForestRegressor
 
 # first party
 from src.models import sf, reg
+from src.models.gurobi_env import get_setup_time, init_env
 from src.utils.delphi_epidata import Epidata
+from src.utils import epidata_replay
 from src.utils.epiweek import add_epiweeks
 from src.utils.flu_data_source import FluDataSource
+from src.utils.memory import BudgetedPool
+from src.utils.metrics import metrics
+from src.utils.resources import ThreadBudget, get_budget, init_worker
 from src.utils.sim_helper import *
+from src.utils.trace import tracer
+from src.utils.training_history import TrainingHistory, impute
 from src.utils.us_fusion import UsFusion
 
 
-def get_training_data(ew, ds, n_train_weeks=N_TRAIN_WEEKS, regions=REGION_LIST):
-    inputs = list(itertools.product(SENSORS, regions))
-    n_inputs = len(inputs)
+# heavy dependencies, only imported by the stage that needs them
+DEFERRED_IMPORTS = ["requests", "gurobipy", "sklearn.ensemble"]
 
-    test_weeks = list([ew])
-    train_weeks = list(range_epiweeks(FIRST_EPIWEEK, ew, inclusive=False))
-    if len(train_weeks) >= n_train_weeks:
-        train_weeks = train_weeks[len(train_weeks) - n_train_weeks:]
-    n_train_weeks = len(train_weeks)
-    logging.info(f"Number of training weeks is {n_train_weeks}")
 
-    readings = np.full((1, n_inputs), np.nan)
-    sensor_vals = np.full((n_train_weeks, n_inputs), np.nan)
-    for col, (sen, loc) in enumerate(inputs):
-        sensor_vals[:, col] = ds.get_sensor_values(tuple(train_weeks), loc, sen)
+# regularized methods, tuned by cross-validation
+CV_METHODS = [("sf_l2", sf.sf_l2, RIDGE_PARAMS),
+              ("sf_l1", sf.sf_l1, LASSO_PARAMS),
+              ("ridge", reg.ridge, RIDGE_PARAMS),
+              ("lasso", reg.lasso, LASSO_PARAMS)]
 
-        for row, week in enumerate(test_weeks):
-            value = ds.get_sensor_value(week, loc, sen)
-            if value is not None:
-                readings[row, col] = value
 
-    hist_wili = np.full((n_train_weeks, len(ATOM_LIST)), np.nan)
-    for col, loc in enumerate(ATOM_LIST):
-        hist_wili[:, col] = ds.get_truth_values(tuple(train_weeks), loc)
+def profile_startup(ctx, param, value):
+    """Report start-up, worker spawn and deferred import times, then exit."""
+    if not value or ctx.resilient_parsing:
+        return
+    click.echo(f"CLI ready after {time.perf_counter() - START_TIME:.3f}s")
 
-    # remove empty columns
+    start = time.perf_counter()
+    with Pool(1, initializer=init_worker, initargs=(ThreadBudget(),)) as p:
+        p.apply(os.getpid)
+    click.echo(f"Worker spawned in {time.perf_counter() - start:.3f}s")
+
+    for name in DEFERRED_IMPORTS:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        click.echo(f"Deferred import of {name} takes "
+                   f"{time.perf_counter() - start:.3f}s")
+    ctx.exit()
+
+
+@tracer.traced("get_training_data")
+@metrics.timed("get_training_data")
+def get_training_data(ew, ds, n_train_weeks=N_TRAIN_WEEKS, regions=REGION_LIST,
+                      sensors=SENSORS, atoms=ATOM_LIST, exclude=EXCLUDE_LOC,
+                      as_of=False, history=None):
+    """Assemble the training data for nowcasting ew.
+
+    If as_of, ground truth is taken as published in the issue before ew (the
+    latest one available at the time) instead of its finalized values.
+    Otherwise, if a TrainingHistory of the same inputs and atoms is given
+    (see get_training_history), the data is cut from it instead of fetched;
+    a history of other inputs or atoms raises an Exception.
+    """
+    inputs = list(itertools.product(sensors, regions))
     get_finite_columns = lambda d: np.any(np.isfinite(d), axis=0)
-    finite_sensors = get_finite_columns(sensor_vals)
+
+    if history is not None and not as_of:
+        if history.inputs != inputs or history.atoms != list(atoms):
+            raise Exception("The training history was built for other "
+                            "sensors, regions or atoms.")
+        # views of the history, imputed with its cached statistics below
+        train_weeks, sensor_vals, hist_wili, readings = history.window(
+            ew, n_train_weeks)
+        sensor_means, wili_means, finite_sensors = history.stats(
+            ew, n_train_weeks)
+    else:
+        test_weeks = list([ew])
+        train_weeks = list(range_epiweeks(FIRST_EPIWEEK, ew, inclusive=False))
+        if len(train_weeks) >= n_train_weeks:
+            train_weeks = train_weeks[len(train_weeks) - n_train_weeks:]
+
+        sensor_vals = ds.get_sensor_matrix(train_weeks, inputs)
+        readings = ds.get_sensor_matrix(test_weeks, inputs)
+        if as_of:
+            hist_wili = ds.get_truth_matrix_as_of(
+                add_epiweeks(ew, -1), train_weeks, atoms)
+        else:
+            hist_wili = ds.get_truth_matrix(train_weeks, atoms)
+        history = None
+        finite_sensors = get_finite_columns(sensor_vals)
+    n_train_weeks = len(train_weeks)
+    logging.info(f"Number of training weeks is {n_train_weeks}")
+
+    # remove empty columns
     finite_readings = get_finite_columns(readings)
     keep_columns = np.logical_and(finite_sensors, finite_readings)
     inputs = list(itertools.compress(inputs, keep_columns))
@@ -58,54 +118,169 @@ def get_training_data(ew, ds, n_train_weeks=N_TRAIN_WEEKS, regions=REGION_LIST):
 
     # construct H, W
     selected_inputs = tuple([loc for (sens, loc) in inputs])
-    H, W, output_locs = UsFusion.determine_statespace(
-        selected_inputs, season=None, exclude_locations=tuple(EXCLUDE_LOC))
+    with metrics.timer("determine_statespace"):
+        H, W, output_locs = UsFusion.determine_statespace(
+            selected_inputs, season=None,
+            exclude_locations=tuple(exclude))
 
     # if any current readings are nan, then fill with historical mean
     if np.sum(np.isnan(readings)) != 0:
-        means = np.nanmean(sensor_vals, axis=0)
+        if history is None:
+            means = np.nanmean(sensor_vals, axis=0)
+        else:
+            means = sensor_means[keep_columns]
         inds = np.where(np.isnan(readings))
         readings[inds] = np.take(means, inds[1])
 
+    if history is None:
+        hist_wili, sensor_vals = mean_impute(hist_wili), mean_impute(sensor_vals)
+    else:
+        hist_wili = impute(hist_wili, wili_means)
+        sensor_vals = impute(sensor_vals, sensor_means[keep_columns])
+
     logging.debug(hist_wili.shape)
     logging.info(f"Shape of Z is {sensor_vals.shape}")
-    return {"wili": mean_impute(hist_wili),
-            "sensors": mean_impute(sensor_vals),
+    return {"wili": hist_wili,
+            "sensors": sensor_vals,
             "new_sensors": readings,
-            "H": H, "W": W, "output_locs": output_locs}
+            "H": H, "W": W, "output_locs": output_locs, "atoms": atoms}
+
+
+def get_training_history(last_ew, ds, regions=REGION_LIST, sensors=SENSORS,
+                         atoms=ATOM_LIST, directory=HISTORY_DIR):
+    """Fetch the history up to last_ew once, for get_training_data.
+
+    If a directory is given, the history is kept there in memory-mapped files
+    instead of in memory (see training_history.py).
+    """
+    inputs = list(itertools.product(sensors, regions))
+    return TrainingHistory(ds, FIRST_EPIWEEK, last_ew, inputs, atoms,
+                           directory, HISTORY_CHUNK_MB * 2 ** 20)
+
+
+def start_pool(budget, memory_budget=None, track_allocations=False):
+    """Create the module-level worker pool used by `run`.
+
+    Args:
+        budget: ThreadBudget of the run
+        memory_budget: limit on the summed RSS of this process and all pool
+            workers in bytes, or None
+        track_allocations: record the peak Python allocations of every task
+    """
+    global pool
+    pool = BudgetedPool(
+        Pool(budget.n_workers, initializer=init_process,
+             initargs=(budget, metrics.enabled, tracer.enabled)),
+        budget.n_workers, memory_budget, track_allocations)
+    logging.info(f'Starting job with {budget}.')
+    return pool
+
+
+def init_process(budget, collect_metrics=False, collect_trace=False):
+    """Pool initializer: apply the thread budget and start a Gurobi env."""
+    metrics.enabled = collect_metrics
+    tracer.enabled = collect_trace
+    init_worker(budget)
+    init_env()
+    metrics.record("gurobi.env_setup", get_setup_time())
+    logging.info(f"Worker {os.getpid()} started its Gurobi environment in "
+                 f"{get_setup_time():.3f}s.")
 
 
 def cv(method_key, cv_ew, method, X, Z, H, new_z, truth, params):
     """Cross-validation function for parallelization."""
     logging.debug(f'[CV] Running {method_key} for {cv_ew}')
-    Beta = method(X, Z, H, params)
+    with tracer.span(f"cv {method_key}", "task", method=method_key,
+                     cv_ew=cv_ew, lams=len(params), first_lam=params[0],
+                     last_lam=params[-1]), metrics.timer(f"cv.{method_key}"):
+        Beta = method(X, Z, H, params)
     x_hats = new_z @ Beta
     errors = np.mean(np.abs(np.subtract(x_hats, truth)), axis=1)
-    return {"cv_ew": cv_ew, "method_key": method_key, "errors": errors}
+    return {"cv_ew": cv_ew, "method_key": method_key, "errors": errors,
+            "metrics": metrics.drain(), "trace": tracer.drain()}
 
 
 def predict(method_key, ew, method, X, Z, H, W, new_z, param):
     """Prediction function for parallelization."""
     logging.debug(f'[FINAL] Running {method_key} for {ew}'
                   f'. The best param is {param:.3f}.')
-    Beta = method(X, Z, H, [param])
+    with tracer.span(f"predict {method_key}", "task", method=method_key,
+                     ew=ew, lam=param), metrics.timer(f"predict.{method_key}"):
+        Beta = method(X, Z, H, [param])
     x_hat = ((new_z @ Beta) @ W.T).flatten()
-    return {"x_hat": x_hat, "method_key": method_key}
+    return {"x_hat": x_hat, "method_key": method_key,
+            "metrics": metrics.drain(), "trace": tracer.drain()}
 
 
-def run(ew_to_pred, cv_dict, methods, ds):
-    data = get_training_data(ew_to_pred, ds)
+def rf(ew, atom, X, y, new_z, max_features, seed):
+    """Random forest function for parallelization (one atom)."""
+    from sklearn.ensemble import RandomForestRegressor  # loaded on first use
+    with tracer.span("rf", "task", method="rf_sensor", ew=ew, atom=atom), \
+            metrics.timer("rf"):
+        rfc = RandomForestRegressor(n_estimators=N_ESTIMATORS,
+                                    max_features=max_features,
+                                    n_jobs=get_budget().n_jobs,
+                                    random_state=seed)
+        rfc.fit(X, y)
+        x_hat = rfc.predict(new_z.reshape(1, -1))[0]
+    return {"x_hat": x_hat, "metrics": metrics.drain(),
+            "trace": tracer.drain()}
+
+
+def merge_task_stats(res):
+    """Merge the metrics and trace events returned by a pool task."""
+    metrics.merge(res["metrics"])
+    tracer.merge(res["trace"])
+
+
+def run(ew_to_pred, cv_dict, methods, ds, data=None):
+    """Nowcast one epiweek.
+
+    All work is submitted to the pool up front and runs as a dependency-driven
+    pipeline: a method's final prediction is submitted (from the pool's result
+    thread) as soon as its own cv errors are in, while the unregularized fits
+    and the random forests fill the remaining workers.
+    """
+    if data is None:
+        data = get_training_data(ew_to_pred, ds)
     assert np.sum(np.isnan(data["sensors"])) == 0
 
     # calculate one-week-ahead prediction error for parameter grid
     # this is like cross-validation, for this time series context
     cv_weeks = list(range_epiweeks(add_epiweeks(ew_to_pred, -N_CV_TIMEPOINTS),
                                    ew_to_pred, inclusive=False))
+    todo = []
     for i, cv_ew in enumerate(cv_weeks):
         if cv_ew in cv_dict:  # if stored, skip calculation
             logging.debug(f"Found stored result for {cv_ew}, skipping")
             continue
+        todo.append((i, cv_ew))
+
+    # run regularized methods with chosen cv parameters
+    predict_results = {}
+    pending = {method_key: len(todo) for method_key, _, _ in methods}
+    lock = threading.Lock()
+
+    def submit_predict(method_key, method, params):
+        errors = np.array([cv_dict[ew][method_key] for ew in cv_weeks])
+        best_param = params[np.argmin(np.mean(errors, axis=0))]
 
+        predict_results[method_key] = pool.apply_async(predict, args=(
+            method_key, ew_to_pred, method, data["wili"], data["sensors"],
+            data["H"], data["W"], data["new_sensors"], best_param))
+
+    def store_cv(res, method):
+        merge_task_stats(res)
+        with lock:
+            cv_ew, method_key = res["cv_ew"], res["method_key"]
+            if cv_ew not in cv_dict: cv_dict[cv_ew] = {}
+            cv_dict[cv_ew][method_key] = res["errors"]
+            pending[method_key] -= 1
+            if pending[method_key] == 0:
+                submit_predict(*method)
+
+    cv_results = []
+    for i, cv_ew in todo:
         end_week_idx = (data["wili"].shape[0] - (i + 1))
         X = data["wili"][:end_week_idx, :]
         Z = data["sensors"][:end_week_idx, :]
@@ -113,94 +288,178 @@ def run(ew_to_pred, cv_dict, methods, ds):
         new_z = data["sensors"][end_week_idx, :]
         truth = data["wili"][end_week_idx, :]
 
-        pool_results = []
         for method_key, method, params in methods:
-            pool_results.append(pool.apply_async(cv, args=(
-                method_key, cv_ew, method, X, Z, H, new_z, truth, params)))
-
-        pool_results = [proc.get() for proc in pool_results]
-        for res in pool_results:
-            cv_ew = res["cv_ew"]
-            if cv_ew not in cv_dict: cv_dict[cv_ew] = {}
-            cv_dict[cv_ew][res["method_key"]] = res["errors"]
+            cv_results.append(pool.apply_async(cv, args=(
+                method_key, cv_ew, method, X, Z, H, new_z, truth, params),
+                callback=functools.partial(
+                    store_cv, method=(method_key, method, params))))
+
+    if not todo:
+        for method in methods:
+            submit_predict(*method)
+
+    # run sf and regression with no regularization
+    logging.info(f"[FINAL] Running sf, regression and RF for {ew_to_pred}.")
+    fit_results = [pool.apply_async(predict, args=(
+        method_key, ew_to_pred, method, data["wili"], data["sensors"],
+        data["H"], data["W"], data["new_sensors"], 0))
+        for method_key, method in [("sf", sf.sf_l2), ("reg", reg.ridge)]]
+
+    # run random forest (sensors), one task per atom
+    max_features = int(data["sensors"].shape[1] / 3)
+    rf_results = [pool.apply_async(rf, args=(
+        ew_to_pred, atom, data["sensors"], data["wili"][:, i],
+        data["new_sensors"], max_features, np.random.randint(2 ** 31)))
+        for i, atom in enumerate(data["atoms"])]
 
     # start prediction
     predictions = {ew_to_pred: {}}
 
-    # run regularized methods with chosen cv parameters
-    pool_results = []
-    for method_key, method, params in methods:
-        errors = np.array([cv_dict[ew][method_key] for ew in cv_weeks])
-        best_param = params[np.argmin(np.mean(errors, axis=0))]
+    with tracer.span("wait for pool", ew=ew_to_pred):
+        # re-raise cv errors; once these are in, all predictions are submitted
+        for proc in cv_results:
+            proc.result()
 
-        pool_results.append(pool.apply_async(predict, args=(
-            method_key, ew_to_pred, method, data["wili"], data["sensors"],
-            data["H"], data["W"], data["new_sensors"], best_param)))
+        pool_results = [predict_results[key] for key, _, _ in methods]
+        pool_results = [proc.result() for proc in pool_results + fit_results]
+        rf_results = [proc.result() for proc in rf_results]
 
-    pool_results = [proc.get() for proc in pool_results]
     for res in pool_results:
+        merge_task_stats(res)
         predictions[ew_to_pred][res["method_key"]] = res["x_hat"]
 
-    # run sf with no regularization
-    logging.info(f"[FINAL] Running sf for {ew_to_pred}.")
-    sf_Beta = sf.sf_l2(data["wili"], data["sensors"], data["H"], [0])
-    sf_x_hat = ((data["new_sensors"] @ sf_Beta) @ data["W"].T).flatten()
-    predictions[ew_to_pred]["sf"] = sf_x_hat
-
-    # run regression with no regularization
-    logging.info(f"[FINAL] Running regression for {ew_to_pred}.")
-    reg_Beta = reg.ridge(data["wili"], data["sensors"], data["H"], [0])
-    reg_x_hat = ((data["new_sensors"] @ reg_Beta) @ data["W"].T).flatten()
-    predictions[ew_to_pred]["reg"] = reg_x_hat
-
-    # run random forest (sensors)
-    logging.info(f"[FINAL] Running RF for {ew_to_pred}.")
-    max_features = int(data["sensors"].shape[1] / 3)
-    all_results = np.empty(len(ATOM_LIST))
-    for i in range(len(ATOM_LIST)):
-        rfc = RandomForestRegressor(n_estimators=N_ESTIMATORS,
-                                    max_features=max_features)
-        rfc.fit(data["sensors"], data["wili"][:, i])
-        all_results[i] = rfc.predict(data["new_sensors"].reshape(1, -1))
+    for res in rf_results:
+        merge_task_stats(res)
+    all_results = np.array([res["x_hat"] for res in rf_results])
     rf_x_hat = (data["W"] @ all_results.reshape(-1, 1)).flatten()
     predictions[ew_to_pred]["rf_sensor"] = rf_x_hat
 
     return {"ew": ew_to_pred, "preds": predictions, "locs": data["output_locs"]}
 
 
+def simulate(weeks, ds, out_file, methods=CV_METHODS, history_dir=HISTORY_DIR,
+             **data_args):
+    """Nowcast the given weeks in turn, returning the wall time of each week.
+
+    The next week's training data is assembled while the current week solves,
+    cut from the history of the whole season (unless as_of is given), which
+    is memory-mapped from files in history_dir if given. Extra keyword
+    arguments are passed on to `get_training_data`.
+    """
+    if not weeks:
+        return []
+    cv_dict = {}
+    if not data_args.get("as_of"):
+        with metrics.timer("get_training_history"):
+            data_args["history"] = get_training_history(
+                max(weeks), ds, directory=history_dir,
+                **{key: data_args[key] for key in ("regions", "sensors", "atoms")
+                   if key in data_args})
+    load = functools.partial(get_training_data, ds=ds, **data_args)
+    prefetch = ThreadPoolExecutor(max_workers=1)
+    next_data = prefetch.submit(load, weeks[0])
+
+    week_seconds = []
+    for i, ew in enumerate(weeks):
+        start = time.perf_counter()
+        data = next_data.result()
+        if i + 1 < len(weeks):
+            next_data = prefetch.submit(load, weeks[i + 1])
+        with tracer.span("run", ew=ew):
+            pred = run(ew, cv_dict, methods, ds, data)
+        logging.debug(pred)
+        with metrics.timer("save_prediction"):
+            out_file.save_prediction(pred)
+        week_seconds.append(time.perf_counter() - start)
+        logging.info(f"Finished {ew}.")
+
+    prefetch.shutdown()
+    return week_seconds
+
+
 @click.command()
 @click.argument('start', type=int)
 @click.argument('end', type=int)
 @click.argument('out', type=str)
-def init(start, end, out):
+@click.option('--cores', type=int, default=N_CORES,
+              help='Total number of cores to use (default: all).')
+@click.option('--threads-per-task', type=int, default=THREADS_PER_TASK,
+              help='Threads per solver/BLAS/RF task; more threads per task '
+                   'means fewer concurrent workers.')
+@click.option('--profile-startup', is_flag=True, is_eager=True,
+              expose_value=False, callback=profile_startup,
+              help='Report start-up costs and exit.')
+@click.option('--metrics', 'metrics_file', type=str, default=None,
+              help='Record hot-path timings and counters to this file.')
+@click.option('--metrics-format', type=click.Choice(['jsonl', 'prometheus']),
+              default='jsonl', help='Format of the metrics file.')
+@click.option('--trace', 'trace_file', type=str, default=None,
+              help='Write a Chrome/Perfetto timeline of all tasks here.')
+@click.option('--memory-budget', type=int, default=MEMORY_BUDGET_MB,
+              help='Limit on the resident memory of the main process and '
+                   'all workers in MB; fewer tasks run at once when another '
+                   'would not fit.')
+@click.option('--track-allocations', is_flag=True,
+              help='Also record the peak Python allocations of every task '
+                   '(slow).')
+@click.option('--cache-dir', type=str, default=CACHE_DIR,
+              help='Directory of the persistent data cache.')
+@click.option('--no-cache', is_flag=True,
+              help='Fetch all data again and do not save it.')
+@click.option('--sync', is_flag=True,
+              help='First fetch new weeks and recent revisions into the '
+                   'cache.')
+@click.option('--as-of', is_flag=True,
+              help='Train on wILI as published at each week, not on '
+                   'finalized values (revision-aware backtest).')
+@click.option('--record', type=str, default=None,
+              help='Save all Epidata responses in this directory.')
+@click.option('--replay', type=str, default=None,
+              help='Serve Epidata requests from a recording in this '
+                   'directory instead of the Delphi API.')
+@click.option('--out-of-core', 'history_dir', type=str, default=HISTORY_DIR,
+              help='Keep the training history in memory-mapped files in this '
+                   'directory instead of in memory.')
+def init(start, end, out, cores, threads_per_task, metrics_file,
+         metrics_format, trace_file, memory_budget, track_allocations,
+         cache_dir, no_cache, sync, as_of, record, replay, history_dir):
+    # set-up multiprocessing
+    metrics.enabled = metrics_file is not None
+    tracer.enabled = trace_file is not None
+    start_pool(ThreadBudget(cores, threads_per_task, max_workers=MAX_WORKERS),
+               memory_budget and memory_budget * 2 ** 20, track_allocations)
+
+    if replay is not None:  # offline, from an earlier --record
+        epidata_replay.ReplayServer(
+            epidata_replay.RecordedResponses(replay)).start()
+    if record is not None:
+        epidata_replay.record(record)
+
     inputs = list(itertools.product(SENSORS, REGION_LIST))
-    ds = FluDataSource(Epidata, SENSORS, inputs)  # FluDataSource on Delphi side
+    # FluDataSource on Delphi side
+    ds = FluDataSource(Epidata, SENSORS, inputs,
+                       None if no_cache else cache_dir, FETCH_CONCURRENCY)
     ds.signal_key = 'wili'
     ds.cache_key = 'ilinet'
-    cache(ds)  # cache sensors for efficiency
-
-    cv_methods = [("sf_l2", sf.sf_l2, RIDGE_PARAMS),
-                  ("sf_l1", sf.sf_l1, LASSO_PARAMS),
-                  ("ridge", reg.ridge, RIDGE_PARAMS),
-                  ("lasso", reg.lasso, LASSO_PARAMS)]
-    cv_dict = {}
+    with tracer.span("cache"), metrics.timer("cache"):
+        if sync:
+            ds.sync(FIRST_EPIWEEK, inputs, REGION_LIST)
+        cache(ds)  # cache sensors for efficiency
+        ds.save_cache()
+        if as_of:
+            ds.load_vintages(FIRST_EPIWEEK, add_epiweeks(end, -1), ATOM_LIST)
 
     filename = datetime.datetime.now().strftime("%Y%m%d.p")
     out_file = ResultFile(out + "-" + filename)
+    simulate(list(range_epiweeks(start, end)), ds, out_file,
+             history_dir=history_dir, as_of=as_of)
 
-    for ew in [ew for ew in range_epiweeks(start, end)]:
-        pred = run(ew, cv_dict, cv_methods, ds)
-        logging.debug(pred)
-        out_file.save_prediction(pred)
-        logging.info(f"Finished {ew}.")
+    if metrics.enabled:
+        metrics.write(metrics_file, metrics_format, run=out)
+    if tracer.enabled:
+        tracer.write(trace_file)
 
 
 if __name__ == "__main__":
     np.random.seed(SEED)
-
-    # set-up multiprocessing
-    n_cpu = min(4, cpu_count())  # going through 4 methods for cv
-    pool = Pool(n_cpu)
-    logging.info(f'Starting job, using {n_cpu} CPUs.')
-
     init()
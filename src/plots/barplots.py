@@ -18,7 +18,8 @@ from src.utils.geo.locations import Locations
 RESULT_PATH = Path.cwd() / "results"
 
 if __name__ == "__main__":
-    ds = FluDataSource(Epidata, [], REGION_LIST)
+    ds = FluDataSource(Epidata, [], REGION_LIST, CACHE_DIR,
+                       FETCH_CONCURRENCY)
     ds.signal_key = 'wili'
     ds.cache_key = 'ilinet'
     files = list(sorted(RESULT_PATH.glob('*.p')))
@@ -56,9 +57,8 @@ if __name__ == "__main__":
                     results[method] = np.empty((n_weeks, n_locs))
                 results[method][i, :] = d['preds'][ew][method]
 
-        wili = np.empty((n_weeks, n_locs))
-        for i, loc in enumerate(locs):
-            wili[:, i] = ds.get_truth_values(tuple(weeks), loc)
+        wili = ds.get_truth_matrix(weeks, locs)
+        ds.save_cache()
 
         groups = [
             ("States",
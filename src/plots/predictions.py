@@ -20,7 +20,8 @@ from src.utils.flu_data_source import FluDataSource
 RESULT_FILE_PATH = Path.cwd() / "results" / "1718.p"
 
 if __name__ == "__main__":
-    ds = FluDataSource(Epidata, SENSORS, REGION_LIST)
+    ds = FluDataSource(Epidata, SENSORS, REGION_LIST, CACHE_DIR,
+                       FETCH_CONCURRENCY)
     ds.signal_key = 'wili'
     ds.cache_key = 'ilinet'
 
@@ -51,9 +52,8 @@ if __name__ == "__main__":
                 results[method] = np.empty((n_weeks, n_locs))
             results[method][i, :] = d['preds'][ew][method]
 
-    wili = np.empty((n_weeks, n_locs))
-    for i, loc in enumerate(locs):
-        wili[:, i] = ds.get_truth_values(tuple(weeks), loc)
+    wili = ds.get_truth_matrix(weeks, locs)
+    ds.save_cache()
 
     # reformat epiweek to date for plotting
     pw = []
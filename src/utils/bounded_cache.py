@@ -0,0 +1,136 @@
+"""
+Purpose: Memoize methods in bounded, instrumented per-instance caches.
+
+Unlike functools.lru_cache on a method, `cached_method` keeps its cache on the
+instance (so the cache does not keep the instance alive), bounds it by
+number of entries and/or approximate bytes, evicts the least recently used
+entries, can expire entries after a time-to-live, counts hits, misses and
+evictions in `metrics`, and can be invalidated explicitly:
+
+    class DataSource:
+        @cached_method(maxsize=1024)
+        def get_missing_locations(self, epiweek):
+            ...
+
+    invalidate(ds)  # or invalidate(ds, "get_missing_locations")
+"""
+
+# standard
+import functools
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# third party
+import numpy as np
+
+# first party
+from src.utils.metrics import metrics
+
+
+def sizeof(value):
+    """Return the approximate size of a value in bytes."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class BoundedCache:
+    """LRU cache bounded by entries and bytes, with optional expiry.
+
+    Args:
+        name: name of the counters in `metrics`
+        maxsize: largest number of entries, or None
+        maxbytes: largest total size of the values in bytes, or None
+        ttl: seconds after which an entry expires, or None
+    """
+
+    def __init__(self, name, maxsize=128, maxbytes=None, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, expiry time)
+        self.nbytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, event):
+        self.stats[event] += 1
+        metrics.count(f"cache.{self.name}.{event}")
+
+    def _remove(self, key):
+        self.nbytes -= self.entries.pop(key)[1]
+
+    def get(self, key, compute):
+        """Return the cached value of key, calling compute() on a miss."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)  # expired
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self._count("hits")
+                return entry[0]
+            self._count("misses")
+
+        value = compute()
+        expiry = float("inf") if self.ttl is None else \
+            time.monotonic() + self.ttl
+        size = sizeof(value)
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, expiry)
+            self.nbytes += size
+            while self.entries and (
+                    (self.maxsize is not None and
+                     len(self.entries) > self.maxsize) or
+                    (self.maxbytes is not None and
+                     self.nbytes > self.maxbytes)):
+                self._remove(next(iter(self.entries)))
+                self._count("evictions")
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one entry, or all entries if key is None."""
+        with self._lock:
+            if key is None:
+                self.entries.clear()
+                self.nbytes = 0
+            elif key in self.entries:
+                self._remove(key)
+
+
+def cached_method(maxsize=128, maxbytes=None, ttl=None):
+    """Decorator memoizing a method by its (hashable) positional arguments."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args):
+            caches = self.__dict__.setdefault("_method_caches", {})
+            cache = caches.get(func.__name__)
+            if cache is None:
+                cache = caches.setdefault(func.__name__, BoundedCache(
+                    func.__name__, maxsize, maxbytes, ttl))
+            return cache.get(args, lambda: func(self, *args))
+        return wrapper
+    return decorator
+
+
+def invalidate(obj, name=None):
+    """Clear the method caches of an object (or only the named one)."""
+    for cache_name, cache in obj.__dict__.get("_method_caches", {}).items():
+        if name is None or name == cache_name:
+            cache.invalidate()
+
+
+def cache_stats(obj):
+    """Return the entries, bytes, hits, misses and evictions of each cache."""
+    return {name: dict(cache.stats, entries=len(cache.entries),
+                       bytes=cache.nbytes)
+            for name, cache in obj.__dict__.get("_method_caches", {}).items()}
@@ -0,0 +1,284 @@
+"""
+Purpose: A dense, array-backed store of weekly signal values.
+
+Values are kept in one float array with (week, signal, location) axes, where
+signals are sensor names or 'ilinet' (ground truth). The week axis covers a
+contiguous range of epiweeks, so the weeks of a window are a slice of it; the
+(weeks x columns) matrix of a window is still gathered from the signal and
+location axes into a new array, one copy per call (training_history.py cuts
+windows without copying).
+Values that were fetched but are not available are NaN; a boolean mask of the
+same shape tells fetched values from values never asked for.
+
+Index maps translate sensor names, locations and epiweeks to positions. The
+axes grow as new signals, locations or weeks are added. For delta syncs, the
+store also remembers the issue each (signal, location) column was last
+brought up to date with.
+
+A store can be saved to a directory as two .npy files and a small JSON index,
+and loaded back memory-mapped (copy-on-write), so nothing is read from disk
+until it is used and values added later stay private to the process. Saving
+writes new files and then atomically replaces the index, so any number of
+processes can load the directory while another one saves (a load whose files
+were removed by later saves reads the new index again); concurrent saves are
+serialized with a lock file and merged.
+"""
+
+# standard
+import fcntl
+import glob
+import json
+import os
+import threading
+import uuid
+
+# third party
+import numpy as np
+
+# first party
+from src.utils.epiweek import add_epiweeks, delta_epiweeks, range_epiweeks
+
+
+INDEX_FILE = "index.json"
+LOCK_FILE = "lock"
+LOAD_ATTEMPTS = 5  # reads of the index before giving up on missing files
+
+
+class ColumnStore:
+    """Weekly values by (signal, location), as one 3-dimensional array."""
+
+    def __init__(self):
+        self.token = None  # name of the saved files this store was loaded from
+        self.modified = False  # whether values were added since loading
+        self.signals = {}  # name -> index
+        self.locations = {}  # location -> index
+        self.weeks = []  # contiguous epiweeks of the week axis
+        self.week_index = {}  # epiweek -> index
+        self.values = np.full((0, 0, 0), np.nan)
+        self.known = np.zeros((0, 0, 0), dtype=bool)
+        self.issues = {}  # (name, location) -> issue the column is synced to
+        self._lock = threading.RLock()  # axes move when the arrays grow
+
+    def _resize(self, n_weeks, n_signals, n_locations, week_offset=0):
+        """Reallocate the arrays, keeping stored values."""
+        values = np.full((n_weeks, n_signals, n_locations), np.nan)
+        known = np.zeros(values.shape, dtype=bool)
+        w, s, l = self.values.shape
+        values[week_offset:week_offset + w, :s, :l] = self.values
+        known[week_offset:week_offset + w, :s, :l] = self.known
+        self.values, self.known = values, known
+
+    def _add_key(self, mapping, key, axis):
+        """Return the index of the key, adding it to the axis if needed."""
+        if key not in mapping:
+            mapping[key] = len(mapping)
+            shape = list(self.values.shape)
+            if mapping[key] >= shape[axis]:
+                shape[axis] = max(4, 2 * shape[axis])  # amortized growth
+                self._resize(*shape)
+        return mapping[key]
+
+    def _add_weeks(self, epiweeks):
+        """Extend the week axis to cover the given epiweeks."""
+        missing = [week for week in epiweeks if week not in self.week_index]
+        if not missing:
+            return
+        first, last, offset = min(missing), max(missing), 0
+        if self.weeks:
+            # grow by at least the current length, so that adding weeks one
+            # at a time stays cheap
+            grow = max(len(self.weeks), 52)
+            if first < self.weeks[0]:
+                first = min(first, add_epiweeks(self.weeks[0], -grow))
+                offset = delta_epiweeks(first, self.weeks[0])
+            else:
+                first = self.weeks[0]
+            if last > self.weeks[-1]:
+                last = max(last, add_epiweeks(self.weeks[-1], grow))
+            else:
+                last = self.weeks[-1]
+        self.weeks = list(range_epiweeks(first, last, inclusive=True))
+        self.week_index = {week: i for i, week in enumerate(self.weeks)}
+        self._resize(len(self.weeks), *self.values.shape[1:],
+                     week_offset=offset)
+
+    def _rows(self, epiweeks):
+        """Return the week axis indices of the epiweeks (-1 if not covered).
+
+        Consecutive epiweeks are returned as a slice, which spares building
+        and broadcasting an index array in the gather.
+        """
+        rows = np.array([self.week_index.get(week, -1) for week in epiweeks],
+                        dtype=int)
+        if len(rows) and rows[0] >= 0 and \
+                np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            return slice(rows[0], rows[0] + len(rows))
+        return rows
+
+    def put(self, name, location, epiweeks, values):
+        """Store the values (None if not available) of the epiweeks."""
+        with self._lock:
+            self._add_weeks(epiweeks)
+            s = self._add_key(self.signals, name, 1)
+            l = self._add_key(self.locations, location, 2)
+            rows = self._rows(epiweeks)
+            self.values[rows, s, l] = np.array(values, dtype=float)
+            self.known[rows, s, l] = True
+            self.modified = True
+
+    def get(self, name, location, epiweek):
+        """Return a stored value, None if not available.
+
+        Raises KeyError if the value was never stored.
+        """
+        with self._lock:
+            s, l = self.signals[name], self.locations[location]
+            row = self.week_index[epiweek]
+            if not self.known[row, s, l]:
+                raise KeyError(epiweek)
+            value = self.values[row, s, l]
+        return None if np.isnan(value) else float(value)
+
+    def get_many(self, name, location, epiweeks):
+        """Return a list of stored values, None where not available.
+
+        Raises KeyError if any value was never stored.
+        """
+        values, known = self.matrix([(name, location)], epiweeks)
+        if not known.all():
+            raise KeyError(location)
+        return [None if np.isnan(v) else float(v) for v in values[:, 0]]
+
+    def matrix(self, columns, epiweeks):
+        """Return the values of the (name, location) columns on the epiweeks.
+
+        Returns:
+            a new (weeks x columns) float array, NaN where not available, and a
+            boolean array of the same shape marking the values that were stored
+        """
+        with self._lock:
+            return self._matrix(columns, epiweeks)
+
+    def _matrix(self, columns, epiweeks):
+        shape = (len(epiweeks), len(columns))
+        s = np.array([self.signals.get(n, -1) for n, _ in columns], dtype=int)
+        l = np.array([self.locations.get(loc, -1) for _, loc in columns],
+                     dtype=int)
+        if not (self.weeks and self.signals and self.locations):
+            return np.full(shape, np.nan), np.zeros(shape, dtype=bool)
+
+        # one gather for the whole window; -1 indices are masked below
+        valid = np.logical_and(s >= 0, l >= 0)[None, :]
+        rows = self._rows(epiweeks)
+        if isinstance(rows, slice):
+            values = self.values[rows, s, l]
+            known = self.known[rows, s, l]
+        else:
+            valid = np.logical_and(valid, (rows >= 0)[:, None])
+            values = self.values[rows[:, None], s, l]
+            known = self.known[rows[:, None], s, l]
+        # the gather is week-minor; return row-major arrays like np.full
+        known = np.ascontiguousarray(np.logical_and(known, valid))
+        values = np.ascontiguousarray(values)
+        values[~known] = np.nan
+        return values, known
+
+    def set_issue(self, columns, issue):
+        """Record that the (name, location) columns are synced to the issue."""
+        with self._lock:
+            for column in columns:
+                self.issues[column] = issue
+            self.modified = True
+
+    def last_weeks(self, columns):
+        """Return the last epiweek with a value in each column (or None)."""
+        values = self.matrix(columns, self.weeks)[0]
+        available = ~np.isnan(values)
+        last = [None] * len(columns)
+        for col in np.flatnonzero(np.any(available, axis=0)):
+            row = len(self.weeks) - 1 - np.argmax(available[::-1, col])
+            last[col] = self.weeks[row]
+        return last
+
+    def update(self, other):
+        """Add the values of another store that are not stored in this one.
+
+        Columns synced to a later issue in the other store take all of its
+        values, since they may have been revised.
+        """
+        columns = [(name, loc) for name in other.signals
+                   for loc in other.locations]
+        newer = np.array([other.issues.get(column, 0) >
+                          self.issues.get(column, 0) for column in columns],
+                         dtype=bool)
+        values, known = other.matrix(columns, other.weeks)
+        known &= np.logical_or(~self.matrix(columns, other.weeks)[1], newer)
+        weeks = np.array(other.weeks)
+        for col in np.flatnonzero(np.any(known, axis=0)):
+            rows = known[:, col]
+            self.put(*columns[col], weeks[rows].tolist(), values[rows, col])
+        for column, issue in other.issues.items():
+            if issue > self.issues.get(column, 0):
+                self.issues[column] = issue
+
+    @classmethod
+    def load(cls, directory):
+        """Return the store saved in the directory (empty if there is none).
+
+        Saves remove files of older generations, so if the files of the index
+        are gone by the time they are opened, the index is read again.
+        """
+        for attempt in range(LOAD_ATTEMPTS):
+            try:
+                return cls._load(directory)
+            except FileNotFoundError as e:
+                if str(e.filename).endswith(INDEX_FILE):
+                    return cls()
+                if attempt == LOAD_ATTEMPTS - 1:
+                    raise
+
+    @classmethod
+    def _load(cls, directory):
+        store = cls()
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            index = json.load(f)
+        store.signals = {name: i for i, name in enumerate(index["signals"])}
+        store.locations = {loc: i for i, loc in enumerate(index["locations"])}
+        store.weeks = index["weeks"]
+        store.week_index = {week: i for i, week in enumerate(store.weeks)}
+        store.issues = {(name, loc): issue
+                        for name, loc, issue in index.get("issues", [])}
+        path = os.path.join(directory, "{}-" + index["token"] + ".npy")
+        store.values = np.load(path.format("values"), mmap_mode="c")
+        store.known = np.load(path.format("known"), mmap_mode="c")
+        store.token = index["token"]
+        return store
+
+    def save(self, directory):
+        """Save the store, merging values saved by other processes meanwhile."""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock, open(os.path.join(directory, LOCK_FILE), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            saved = ColumnStore.load(directory)
+            if saved.token not in (None, self.token):
+                self.update(saved)
+
+            # files are only visible once the index points to them
+            token = uuid.uuid4().hex
+            path = os.path.join(directory, "{}-" + token + ".npy")
+            np.save(path.format("values"), self.values)
+            np.save(path.format("known"), self.known)
+            index = {"token": token, "signals": list(self.signals),
+                     "locations": list(self.locations), "weeks": self.weeks,
+                     "issues": [[name, loc, issue] for (name, loc), issue
+                                in self.issues.items()]}
+            tmp = os.path.join(directory, f"{INDEX_FILE}.{token}")
+            with open(tmp, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp, os.path.join(directory, INDEX_FILE))
+
+            # keep the previous files for processes still loading them
+            for name in glob.glob(os.path.join(directory, "*.npy")):
+                if not name.endswith((f"-{token}.npy", f"-{saved.token}.npy")):
+                    os.remove(name)
+        self.token, self.modified = token, False
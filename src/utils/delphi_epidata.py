@@ -8,10 +8,12 @@ https://github.com/cmu-delphi/delphi-epidata
 Notes:
  - Requires the `requests` module.
  - Compatible with Python 2 and 3.
+ - Requests share one keep-alive session with a bounded connection pool,
+   timeouts, retries with exponential backoff and compressed responses.
 """
 
-# External modules
-import requests
+# standard
+import threading
 
 
 # Because the API is stateless, the Epidata class only contains static methods
@@ -21,6 +23,23 @@ class Epidata:
     # API base url
     BASE_URL = 'https://delphi.midas.cs.cmu.edu/epidata/api.php'
 
+    # HTTP settings: (connect, read) timeouts in seconds, retries of failed
+    # requests (with backoff_factor * 2^n seconds in between) and the number
+    # of connections kept alive
+    TIMEOUT = (5, 60)
+    RETRIES = 3
+    BACKOFF_FACTOR = 0.5
+    POOL_SIZE = 16
+
+    # row fields kept by columnar (streamed) requests, and the read size
+    FLUVIEW_FIELDS = ('region', 'epiweek', 'issue', 'wili', 'num_providers')
+    SENSORS_FIELDS = ('name', 'location', 'epiweek', 'value')
+    CHUNK_SIZE = 1 << 16
+
+    # shared requests.Session, created on first request
+    _session = None
+    _session_lock = threading.Lock()
+
     # Helper function to cast values and/or ranges to strings
     @staticmethod
     def _listitem(value):
@@ -38,17 +57,64 @@ class Epidata:
             values = [values]
         return ','.join([Epidata._listitem(value) for value in values])
 
+    # Helper function to create the shared HTTP session
+    @staticmethod
+    def _get_session():
+        """Return the keep-alive session, creating it on first use."""
+        with Epidata._session_lock:
+            if Epidata._session is None:
+                import requests  # loaded on first request
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                retry = Retry(total=Epidata.RETRIES,
+                              backoff_factor=Epidata.BACKOFF_FACTOR,
+                              status_forcelist=(429, 500, 502, 503, 504),
+                              allowed_methods=('GET',))
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=Epidata.POOL_SIZE,
+                                      pool_block=True, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['Accept-Encoding'] = 'gzip, deflate'
+                Epidata._session = session
+            return Epidata._session
+
     # Helper function to request and parse epidata
     @staticmethod
-    def _request(params):
-        """Request and parse epidata."""
+    def _request(params, fields=None):
+        """Request and parse epidata.
+
+        If fields are given, the response is parsed as it streams in and
+        'epidata' holds one array per field instead of a list of rows.
+        """
         try:
             # API call
-            return requests.get(Epidata.BASE_URL, params).json()
+            response = Epidata._get_session().get(
+                Epidata.BASE_URL, params=params, timeout=Epidata.TIMEOUT,
+                stream=fields is not None)
+            # closing a streamed response hands its connection back to the
+            # pool, also when it is an error
+            with response:
+                response.raise_for_status()
+                if fields is None:
+                    return response.json()
+                from src.utils.epidata_stream import parse
+                return parse(response.iter_content(Epidata.CHUNK_SIZE), fields)
         except Exception as e:
-            # Something broke
+            # Something broke, say nothing about the data
             return {'result': 0, 'message': 'error: ' + str(e)}
 
+    # Tell failed requests from answers, such as "no results" (result=-2)
+    @staticmethod
+    def is_transient(resp):
+        """Return True if the request failed without an answer about the data.
+
+        Such failures (network errors, timeouts, server errors) may succeed
+        later and must not be cached as missing data.
+        """
+        return resp['result'] not in (1, 2, -2)
+
     # Raise an Exception on error, otherwise return epidata
     @staticmethod
     def check(resp):
@@ -69,8 +135,9 @@ class Epidata:
 
     # Fetch FluView data
     @staticmethod
-    def fluview(regions, epiweeks, issues=None, lag=None, auth=None):
-        """Fetch FluView data."""
+    def fluview(regions, epiweeks, issues=None, lag=None, auth=None,
+                columnar=False):
+        """Fetch FluView data (as arrays of FLUVIEW_FIELDS if columnar)."""
         # Check parameters
         if regions is None or epiweeks is None:
             raise Exception('`regions` and `epiweeks` are both required')
@@ -89,7 +156,8 @@ class Epidata:
         if auth is not None:
             params['auth'] = auth
         # Make the API call
-        return Epidata._request(params)
+        return Epidata._request(
+            params, Epidata.FLUVIEW_FIELDS if columnar else None)
 
     # Fetch Google Flu Trends data
     @staticmethod
@@ -192,8 +260,11 @@ class Epidata:
 
     # Fetch Delphi's digital surveillance sensors
     @staticmethod
-    def sensors(auth, names, locations, epiweeks):
-        """Fetch Delphi's digital surveillance sensors."""
+    def sensors(auth, names, locations, epiweeks, columnar=False):
+        """Fetch Delphi's digital surveillance sensors.
+
+        If columnar, 'epidata' holds arrays of SENSORS_FIELDS.
+        """
         # Check parameters
         if auth is None or names is None or locations is None or epiweeks is None:
             raise Exception(
@@ -207,4 +278,5 @@ class Epidata:
             'epiweeks': Epidata._list(epiweeks),
         }
         # Make the API call
-        return Epidata._request(params)
+        return Epidata._request(
+            params, Epidata.SENSORS_FIELDS if columnar else None)
@@ -0,0 +1,83 @@
+"""
+Purpose: Decode Epidata responses into aligned NumPy arrays.
+
+A response is first turned into one array per field (`sensor_arrays`,
+`fluview_arrays`; responses requested with `columnar=True` already are),
+then `align` places every row in a (weeks x columns) matrix, where columns
+are (name, location) pairs, with a single sort/searchsorted join on
+epiweeks. Decoding is linear in the number of rows, and the matrix can be
+written to the cache one column at a time.
+"""
+
+# third party
+import numpy as np
+
+
+def sensor_arrays(rows):
+    """Return the name, location, epiweek and value of sensor rows."""
+    if isinstance(rows, dict):
+        return rows  # columnar
+    n = len(rows)
+    return {"name": [row['name'] for row in rows],
+            "location": [row['location'] for row in rows],
+            "epiweek": np.fromiter((row['epiweek'] for row in rows), int, n),
+            "value": np.array([row['value'] for row in rows], dtype=float)}
+
+
+def fluview_arrays(rows):
+    """Return the location, epiweek, issue and wILI of fluview rows.
+
+    wILI is NaN for weeks without reporting providers.
+    """
+    if isinstance(rows, dict):  # columnar
+        arrays = {"location": rows['region'], "epiweek": rows['epiweek'],
+                  "issue": rows['issue'], "value": rows['wili'].copy()}
+        providers = rows['num_providers']
+    else:
+        n = len(rows)
+        arrays = {
+            "location": [row['region'] for row in rows],
+            "epiweek": np.fromiter((row['epiweek'] for row in rows), int, n),
+            "issue": np.fromiter((row['issue'] for row in rows), int, n),
+            "value": np.array([row['wili'] for row in rows], dtype=float)}
+        providers = np.fromiter((row['num_providers'] for row in rows), int, n)
+    arrays["value"][providers == 0] = np.nan
+    return arrays
+
+
+def align(arrays, columns, epiweeks, name=None):
+    """Place decoded rows in a (weeks x columns) matrix.
+
+    Args:
+        arrays: decoded fields, with "location", "epiweek", "value" and
+            (unless `name` is given) "name"
+        columns: (name, location) pairs of the matrix
+        epiweeks: epiweeks of the matrix
+        name: name of all rows, if the response has no name field
+
+    Returns:
+        the values (NaN where missing) and a boolean array of the same shape
+        marking the cells present in the response
+    """
+    shape = (len(epiweeks), len(columns))
+    values = np.full(shape, np.nan)
+    found = np.zeros(shape, dtype=bool)
+    n = len(arrays["epiweek"])
+    if not n or not len(epiweeks):
+        return values, found
+
+    index = {column: i for i, column in enumerate(columns)}
+    names = arrays["name"] if name is None else [name] * n
+    codes = np.fromiter((index.get(column, -1) for column
+                         in zip(names, arrays["location"])), int, n)
+
+    weeks = np.asarray(epiweeks)
+    order = np.argsort(weeks, kind="stable")
+    sorted_weeks = weeks[order]
+    pos = np.minimum(np.searchsorted(sorted_weeks, arrays["epiweek"]),
+                     len(weeks) - 1)
+    match = np.logical_and(sorted_weeks[pos] == arrays["epiweek"], codes >= 0)
+    rows, cols = order[pos[match]], codes[match]
+    values[rows, cols] = arrays["value"][match]
+    found[rows, cols] = True
+    return values, found
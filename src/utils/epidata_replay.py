@@ -0,0 +1,279 @@
+"""
+Purpose: Record Epidata responses and serve them again without Delphi access.
+
+`record(directory)` saves the body of every response the Epidata client
+receives from then on, keyed by the request parameters (without `auth`).
+A `ReplayServer` is a local HTTP server standing in for the Epidata API: it
+answers requests from such a recording (`RecordedResponses`) or from any
+DataSource, such as a SyntheticDataSource (`SyntheticResponses`), optionally
+after a fixed latency and with a share of requests failing with HTTP 503.
+While it runs, Epidata.BASE_URL points to it, so the whole fetch path
+(session, retries, streaming, concurrency) runs unchanged:
+
+    with ReplayServer(SyntheticResponses(ds), latency=0.05, error_rate=0.1):
+        cache(FluDataSource(Epidata, sensors, inputs))
+
+Run as a script (`python -m src.utils.epidata_replay`), it checks the fetch
+path against failure cases of the API that once broke it.
+"""
+
+# standard
+import hashlib
+import http.server
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+# third party
+import numpy as np
+
+# first party
+from src.utils.delphi_epidata import Epidata
+from src.utils.epiweek import add_epiweeks, delta_epiweeks, range_epiweeks
+from src.utils.fetch_planner import MAX_ROWS
+from src.utils.flu_data_source import FluDataSource
+
+
+def request_key(params):
+    """Return a file name identifying a request by its parameters."""
+    items = sorted((key, str(value)) for key, value in params.items()
+                   if key != 'auth')
+    return hashlib.sha1(urllib.parse.urlencode(items).encode()).hexdigest()
+
+
+def parse_list(value):
+    """Return the items of an Epidata list parameter, expanding ranges."""
+    items = []
+    for item in value.split(','):
+        first, _, last = item.partition('-')
+        if last and first.isdigit() and last.isdigit():
+            items.extend(range_epiweeks(int(first), int(last), inclusive=True))
+        else:
+            items.append(int(item) if item.isdigit() else item)
+    return items
+
+
+class Recorder:
+    """Session saving the body of every response in a directory.
+
+    Args:
+        directory: directory of the recording
+        session: session making the actual requests
+    """
+
+    def __init__(self, directory, session):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.session = session
+
+    def get(self, url, params=None, **kwargs):
+        kwargs['stream'] = False  # read the whole body before saving it
+        response = self.session.get(url, params=params, **kwargs)
+        if response.ok:
+            path = os.path.join(self.directory, request_key(params or {}))
+            with open(path + '.tmp', 'wb') as f:
+                f.write(response.content)
+            os.replace(path + '.tmp', path + '.json')
+        return response
+
+
+def record(directory):
+    """Save every Epidata response in the directory from now on."""
+    session = Epidata._get_session()
+    with Epidata._session_lock:
+        Epidata._session = Recorder(directory, session)
+
+
+class RecordedResponses:
+    """Response bodies of a recording, by request parameters."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __call__(self, params):
+        """Return the recorded body, or None if the request was not recorded."""
+        path = os.path.join(self.directory, request_key(params) + '.json')
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class SyntheticResponses:
+    """Response bodies generated from a DataSource.
+
+    Only the `fluview` and `sensors` sources are served. Values are never
+    revised: every issue publishes the final values of its last
+    FluDataSource.ISSUE_WEEKS weeks.
+
+    Args:
+        ds: DataSource providing the values
+        max_rows: row limit; larger responses are truncated (result 2)
+    """
+
+    def __init__(self, ds, max_rows=MAX_ROWS):
+        self.ds = ds
+        self.max_rows = max_rows
+        self.latest_issue = max(ds.get_weeks())
+
+    def __call__(self, params):
+        if params.get('source') == 'fluview':
+            rows = self.fluview(params)
+        elif params.get('source') == 'sensors':
+            rows = self.sensors(params)
+        else:
+            return None
+        if not rows:
+            response = {'result': -2, 'message': 'no results'}
+        elif len(rows) > self.max_rows:
+            response = {'result': 2, 'epidata': rows[:self.max_rows],
+                        'message': 'too many results, data truncated'}
+        else:
+            response = {'result': 1, 'epidata': rows, 'message': 'success'}
+        return json.dumps(response).encode()
+
+    def fluview(self, params):
+        issues = parse_list(params['issues']) if 'issues' in params else None
+        rows = []
+        for loc in parse_list(params['regions']):
+            for week in parse_list(params['epiweeks']):
+                wili = self.ds.get_truth_value(week, loc)
+                # without issues, the last issue publishing the week
+                last = min(self.latest_issue,
+                           add_epiweeks(week, FluDataSource.ISSUE_WEEKS - 1))
+                for issue in issues or [last]:
+                    lag = delta_epiweeks(week, issue)
+                    if not 0 <= lag < FluDataSource.ISSUE_WEEKS or \
+                            issue > self.latest_issue:
+                        continue
+                    rows.append({'release_date': None, 'region': loc,
+                                 'issue': issue, 'epiweek': week, 'lag': lag,
+                                 'num_ili': None, 'num_patients': None,
+                                 'num_providers': 0 if wili is None else 1,
+                                 'wili': 0 if wili is None else wili,
+                                 'ili': 0 if wili is None else wili})
+        return rows
+
+    def sensors(self, params):
+        rows = []
+        for name in parse_list(params['names']):
+            for loc in parse_list(params['locations']):
+                for week in parse_list(params['epiweeks']):
+                    value = self.ds.get_sensor_value(week, loc, name)
+                    if value is not None:
+                        rows.append({'name': name, 'location': loc,
+                                     'epiweek': week, 'value': value})
+        return rows
+
+
+class ReplayServer:
+    """Local stand-in for the Epidata API.
+
+    Args:
+        responses: function returning the body of a request (a dict of
+            parameters), or None for an unknown request (HTTP 404)
+        latency: seconds to wait before every answer
+        error_rate: share of requests answered with HTTP 503
+        seed: seed of the injected errors
+    """
+
+    def __init__(self, responses, latency=0.0, error_rate=0.0, seed=0):
+        self.responses = responses
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = {"requests": 0, "errors": 0, "unknown": 0}
+        self._rng = np.random.RandomState(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._base_url = None
+
+    def _answer(self, params):
+        """Return the HTTP status and body of a request."""
+        time.sleep(self.latency)
+        with self._lock:
+            self.stats["requests"] += 1
+            if self._rng.rand() < self.error_rate:
+                self.stats["errors"] += 1
+                return 503, b''
+        body = self.responses(params)
+        if body is None:
+            with self._lock:
+                self.stats["unknown"] += 1
+            return 404, b''
+        return 200, body
+
+    def start(self):
+        """Start serving and point the Epidata client to this server."""
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+            def do_GET(self):
+                query = urllib.parse.urlsplit(self.path).query
+                params = dict(urllib.parse.parse_qsl(query))
+                status, body = server._answer(params)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        self._base_url = Epidata.BASE_URL
+        Epidata.BASE_URL = 'http://127.0.0.1:%d/' % self._server.server_port
+        return self
+
+    def stop(self):
+        """Stop serving and point the Epidata client back to the API."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            Epidata.BASE_URL = self._base_url
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    # more failing streamed requests than the connection pool holds must not
+    # exhaust it (every answer here is a 404)
+    with ReplayServer(lambda params: None) as server:
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(
+            Epidata.fluview(['pa'], [201501], columnar=True)
+            for _ in range(Epidata.POOL_SIZE + 4)), daemon=True)
+        thread.start()
+        thread.join(timeout=30)
+        assert not thread.is_alive(), 'connection pool exhausted'
+        assert all(Epidata.is_transient(r) for r in results)
+        assert server.stats["unknown"] == Epidata.POOL_SIZE + 4
+
+    # as-of truth of a location first fetched together with one that was
+    # partly held must match a fresh fetch
+    from src.utils.synthetic_data_source import SyntheticDataSource
+    ds = SyntheticDataSource([], ['pa', 'va'], seed=0)
+    with ReplayServer(SyntheticResponses(ds)):
+        fresh, mixed = (FluDataSource(Epidata, [], []) for _ in range(2))
+        mixed.load_vintages(201045, 201452, ['pa'])
+        mixed.get_truth_matrix_as_of(
+            201540, list(range_epiweeks(201330, 201540)), ['pa', 'va'])
+        weeks = list(range_epiweeks(201201, 201240))
+        assert np.array_equal(
+            mixed.get_truth_matrix_as_of(201250, weeks, ['va']),
+            fresh.get_truth_matrix_as_of(201250, weeks, ['va']),
+            equal_nan=True), 'as-of truth missing after a mixed fetch'
@@ -0,0 +1,139 @@
+"""
+Purpose: Parse Epidata JSON responses as a stream, into typed arrays.
+
+`parse` reads a response body chunk by chunk. The small top-level members
+("result", "message") are decoded as usual, while the rows of "epidata" are
+decoded one at a time and only the requested fields are appended to typed
+arrays (int64, float64 or a list of interned strings). No list of row dicts
+is ever built, so peak memory stays close to the size of the arrays, even for
+responses of tens of megabytes.
+"""
+
+# standard
+import codecs
+import json
+from array import array
+
+# third party
+import numpy as np
+
+# type of every field that may be extracted
+FIELD_TYPES = {'name': str, 'location': str, 'region': str, 'epiweek': int,
+               'issue': int, 'num_providers': int, 'wili': float,
+               'value': float}
+
+_WHITESPACE = ' \t\n\r'
+
+
+class _Columns:
+    """Typed arrays collecting the fields of rows."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.columns = {}
+        self.strings = {}  # interned strings
+        for field in fields:
+            kind = FIELD_TYPES[field]
+            self.columns[field] = [] if kind is str else \
+                array('q' if kind is int else 'd')
+
+    def append(self, row):
+        for field in self.fields:
+            value = row.get(field)
+            kind = FIELD_TYPES[field]
+            if kind is str:
+                value = self.strings.setdefault(value, value)
+            elif value is None:
+                value = 0 if kind is int else np.nan
+            self.columns[field].append(value)
+
+    def to_arrays(self):
+        return {field: column if isinstance(column, list) else
+                np.frombuffer(column, dtype=np.int64 if column.typecode == 'q'
+                              else np.float64)
+                for field, column in self.columns.items()}
+
+
+class _Buffer:
+    """Text decoded so far from an iterator of byte (or text) chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def more(self):
+        """Read another chunk, dropping consumed text; False at the end."""
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self.utf8.decode(chunk)
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character (None at the end)."""
+        while True:
+            while self.pos < len(self.text) and \
+                    self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.more():
+                return None
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Malformed Epidata response: expected {char!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.text, self.pos)
+                # a number is only complete once a delimiter follows it
+                if end < len(self.text) or not self.more():
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self.more():
+                    raise
+
+
+def parse(chunks, fields):
+    """Parse a streamed Epidata response.
+
+    Args:
+        chunks: iterator of byte or text chunks of the JSON body
+        fields: row fields to keep (see FIELD_TYPES)
+
+    Returns:
+        a response dict like Epidata._request, except that "epidata" is a
+        dict mapping each field to an array with one value per row
+    """
+    buf = _Buffer(chunks)
+    columns = _Columns(fields)
+    response = {}
+    buf.expect('{')
+    while buf.peek() != '}':
+        if buf.peek() == ',':
+            buf.pos += 1
+        key = buf.value()
+        buf.expect(':')
+        if key == 'epidata' and buf.peek() == '[':
+            buf.pos += 1
+            while buf.peek() != ']':
+                if buf.peek() == ',':
+                    buf.pos += 1
+                columns.append(buf.value())
+            buf.pos += 1
+        else:
+            response[key] = buf.value()
+    response['epidata'] = columns.to_arrays()
+    return response
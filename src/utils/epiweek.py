@@ -7,8 +7,15 @@ https://github.com/cmu-delphi/
 ===============
 
 Epiweek arithmetic and utilities.
+
+Arithmetic goes through a precomputed table of all epiweeks, so adding,
+subtracting and ranging over epiweeks takes constant time per call (or per
+week yielded). The *_array functions do the same on NumPy arrays.
 """
 
+# third party
+import numpy as np
+
 
 def split_epiweek(epiweek):
     """ return a (year, week) pair from this epiweek """
@@ -42,28 +49,36 @@ def get_num_weeks(year):
         return 52
 
 
-def add_epiweeks(epiweek, i):
-    """ return the epiweek plus (or minus) the number of weeks """
+# ordinal <-> epiweek lookup tables covering every year get_num_weeks knows;
+# the ordinal of an epiweek is its number of weeks after the first one
+FIRST_YEAR, LAST_YEAR = 1900, 2099
+_NUM_WEEKS = np.array([get_num_weeks(year)
+                       for year in range(FIRST_YEAR, LAST_YEAR + 1)])
+_YEAR_STARTS = np.concatenate(([0], np.cumsum(_NUM_WEEKS)[:-1]))
+_EPIWEEKS = [join_epiweek(year, week)
+             for year, n in zip(range(FIRST_YEAR, LAST_YEAR + 1), _NUM_WEEKS)
+             for week in range(1, n + 1)]
+_EPIWEEK_ARRAY = np.array(_EPIWEEKS)
+_YEAR_START_LIST = _YEAR_STARTS.tolist()
+
+
+def epiweek_to_ordinal(epiweek):
+    """ return the number of weeks from the first epiweek of FIRST_YEAR """
     check_epiweek(epiweek)
     year, week = split_epiweek(epiweek)
-    while i > 0:
-        weeks_in_year = get_num_weeks(year)
-        dw = min(i, weeks_in_year - week)
-        i -= dw
-        week += dw
-        if i > 0 and week == weeks_in_year:
-            i -= 1
-            year += 1
-            week = 1
-    while i < 0:
-        dw = min(week - 1, -i)
-        i += dw
-        week -= dw
-        if i < 0 and week == 1:
-            i += 1
-            year -= 1
-            week = get_num_weeks(year)
-    return join_epiweek(year, week)
+    return _YEAR_START_LIST[year - FIRST_YEAR] + week - 1
+
+
+def ordinal_to_epiweek(ordinal):
+    """ return the epiweek of an ordinal (see epiweek_to_ordinal) """
+    if not 0 <= ordinal < len(_EPIWEEKS):
+        raise Exception('epiweek out of range: ordinal=%d' % ordinal)
+    return _EPIWEEKS[ordinal]
+
+
+def add_epiweeks(epiweek, i):
+    """ return the epiweek plus (or minus) the number of weeks """
+    return ordinal_to_epiweek(epiweek_to_ordinal(epiweek) + i)
 
 
 def get_season(epiweek, offseason=lambda x: (None, None)):
@@ -80,18 +95,7 @@ def get_season(epiweek, offseason=lambda x: (None, None)):
 
 def delta_epiweeks(ew1, ew2):
     """ return the number of weeks between the two epiweeks """
-    check_epiweek(ew1, ew2)
-    y1, w1 = split_epiweek(ew1)
-    y2, w2 = split_epiweek(ew2)
-    num = 0
-    while y2 > y1:
-        num += get_num_weeks(y2 - 1)
-        y2 -= 1
-    while y2 < y1:
-        num -= get_num_weeks(y2)
-        y2 += 1
-    num += w2 - w1
-    return num
+    return epiweek_to_ordinal(ew2) - epiweek_to_ordinal(ew1)
 
 
 def range_epiweeks(start, stop=None, inclusive=False, num=None):
@@ -110,11 +114,48 @@ def range_epiweeks(start, stop=None, inclusive=False, num=None):
                 num += 1
             else:
                 num -= 1
-    while num > 0:
-        yield start
-        num -= 1
-        start = add_epiweeks(start, 1)
-    while num < 0:
-        yield start
-        num += 1
-        start = add_epiweeks(start, -1)
+    if num == 0:
+        return
+    first = epiweek_to_ordinal(start)
+    last = first + num - 1 if num > 0 else first + num + 1
+    ordinal_to_epiweek(last)  # check the range
+    if num > 0:
+        yield from _EPIWEEKS[first:last + 1]
+    else:
+        yield from reversed(_EPIWEEKS[last:first + 1])
+
+
+def epiweeks_to_ordinals(epiweeks):
+    """ return the ordinals of an array of epiweeks (see epiweek_to_ordinal) """
+    epiweeks = np.asarray(epiweeks, dtype=np.int64)
+    year, week = split_epiweek(epiweeks)
+    index = np.clip(year - FIRST_YEAR, 0, len(_YEAR_STARTS) - 1)
+    valid = (year >= FIRST_YEAR) & (year <= LAST_YEAR) & (week >= 1) & \
+        (week <= _NUM_WEEKS[index])
+    if not np.all(valid):
+        raise Exception('invalid epiweek: epiweek=%d' % epiweeks[~valid][0])
+    return _YEAR_STARTS[index] + week - 1
+
+
+def ordinals_to_epiweeks(ordinals):
+    """ return the epiweeks of an array of ordinals """
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    if np.any((ordinals < 0) | (ordinals >= len(_EPIWEEKS))):
+        raise Exception('epiweek out of range')
+    return _EPIWEEK_ARRAY[ordinals]
+
+
+def add_epiweeks_array(epiweeks, i):
+    """ return an array of epiweeks plus (or minus) the number(s) of weeks """
+    return ordinals_to_epiweeks(epiweeks_to_ordinals(epiweeks) + np.asarray(i))
+
+
+def delta_epiweeks_array(ew1, ew2):
+    """ return the numbers of weeks between two arrays of epiweeks """
+    return epiweeks_to_ordinals(ew2) - epiweeks_to_ordinals(ew1)
+
+
+def range_epiweeks_array(start, stop, inclusive=False):
+    """ return the epiweeks from start to stop (ascending) as an array """
+    first, last = epiweek_to_ordinal(start), epiweek_to_ordinal(stop)
+    return _EPIWEEK_ARRAY[first:last + 1 if inclusive else last].copy()
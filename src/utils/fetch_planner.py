@@ -0,0 +1,67 @@
+"""
+Purpose: Plan the fewest Epidata requests that cover a set of values.
+
+Both the `sensors` and the `fluview` endpoints accept several names/locations
+and epiweek ranges per request and return the cross product. Locations are
+grouped by the set of sensors wanted in them, so that no request returns
+values nobody asked for, and every request is kept below the row limit of the
+API by splitting locations and then weeks. Runs of consecutive epiweeks are
+sent as ranges instead of comma-separated lists.
+"""
+
+# first party
+from src.utils.delphi_epidata import Epidata
+from src.utils.epiweek import add_epiweeks
+
+# maximum number of rows the Epidata API returns for one request
+MAX_ROWS = 3650
+
+
+def compact_epiweeks(epiweeks):
+    """Return the epiweeks as a list of single weeks and Epidata ranges."""
+    items, start, prev = [], None, None
+    for week in sorted(set(epiweeks)):
+        if prev is not None and week == add_epiweeks(prev, 1):
+            prev = week
+            continue
+        if start is not None:
+            items.append(start if start == prev else Epidata.range(start, prev))
+        start = prev = week
+    if start is not None:
+        items.append(start if start == prev else Epidata.range(start, prev))
+    return items
+
+
+def chunks(items, size):
+    """Split a list into consecutive pieces of at most `size` items."""
+    size = max(1, size)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def plan(inputs, epiweeks, max_rows=MAX_ROWS):
+    """Return requests covering the (name, location) inputs on the epiweeks.
+
+    Args:
+        inputs: (name, location) pairs to fetch
+        epiweeks: epiweeks to fetch for every pair
+        max_rows: largest number of rows a request may return
+
+    Returns:
+        a list of (names, locations, epiweeks) requests, where each request
+        asks for every name in every location on every epiweek
+    """
+    names_by_location = {}
+    for name, loc in inputs:
+        names_by_location.setdefault(loc, set()).add(name)
+    locations_by_names = {}
+    for loc, names in names_by_location.items():
+        locations_by_names.setdefault(tuple(sorted(names)), []).append(loc)
+
+    weeks = sorted(set(epiweeks))
+    requests = []
+    for names, locations in locations_by_names.items():
+        for locs in chunks(locations, max_rows // len(names)):
+            per_week = len(names) * len(locs)
+            for part in chunks(weeks, max_rows // per_week):
+                requests.append((list(names), locs, part))
+    return requests
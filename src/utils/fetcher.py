@@ -0,0 +1,136 @@
+"""
+Purpose: Run Epidata requests concurrently under an adaptive limit.
+
+Requests spend nearly all of their time waiting on the network, so a small
+thread pool overlaps them. The number of requests in flight follows an
+additive-increase, multiplicative-decrease rule (like TCP congestion
+control): it grows by one after every fast, successful request and halves
+after a failed or slow one, between 1 and the configured maximum.
+
+Only the requests run in threads; responses are handed back to the caller,
+which stores them, so the data cache is never written concurrently.
+"""
+
+# standard
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# third party
+import numpy as np
+
+# first party
+from src.utils.delphi_epidata import Epidata
+from src.utils.metrics import metrics
+
+
+class AdaptiveLimit:
+    """Additive-increase, multiplicative-decrease limit on concurrency."""
+
+    def __init__(self, maximum, initial=None):
+        self.maximum = maximum
+        self.limit = min(maximum, initial or 4)
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Wait until another request may start."""
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, ok):
+        """Finish a request, adapting the limit to how it went."""
+        with self._cond:
+            self.active -= 1
+            if ok:
+                self.limit = min(self.maximum, self.limit + 1)
+            else:
+                self.limit = max(1, self.limit / 2)
+            self._cond.notify_all()
+
+
+# number of recent request latencies kept for percentiles
+LATENCY_SAMPLE = 1024
+
+
+class Fetcher:
+    """Runs requests with at most `max_concurrency` in flight.
+
+    Latency statistics take constant memory: the count, sum and maximum of all
+    requests, and percentiles of the last LATENCY_SAMPLE requests.
+
+    Args:
+        max_concurrency: largest number of concurrent requests (1: sequential)
+        slow_seconds: requests taking longer count as a sign of overload
+    """
+
+    def __init__(self, max_concurrency=1, slow_seconds=10.0):
+        self.limit = AdaptiveLimit(max_concurrency)
+        self.slow_seconds = slow_seconds
+        self.requests = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.recent = deque(maxlen=LATENCY_SAMPLE)  # seconds
+        self._stats_lock = threading.Lock()
+
+    def _call(self, request):
+        self.limit.acquire()
+        start, response = time.perf_counter(), None
+        try:
+            response = request()
+            return response
+        finally:
+            seconds = time.perf_counter() - start
+            with self._stats_lock:
+                self.requests += 1
+                self.total_seconds += seconds
+                self.max_seconds = max(self.max_seconds, seconds)
+                self.recent.append(seconds)
+            metrics.record('epidata.request', seconds)
+            metrics.peak('epidata.request_seconds', seconds)
+            self.limit.release(response is not None
+                               and not Epidata.is_transient(response)
+                               and seconds < self.slow_seconds)
+
+    def run(self, requests):
+        """Run the requests (functions without arguments) in any order.
+
+        Yields:
+            (index of the request, its response), as requests complete
+        """
+        if self.limit.maximum == 1 or len(requests) < 2:
+            for i, request in enumerate(requests):
+                yield i, self._call(request)
+            return
+
+        with ThreadPoolExecutor(self.limit.maximum) as executor:
+            futures = {executor.submit(self._call, request): i
+                       for i, request in enumerate(requests)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def summary(self):
+        """Return latency statistics of the requests so far."""
+        with self._stats_lock:
+            if not self.requests:
+                return {"requests": 0}
+            recent = np.array(self.recent)
+            return {"requests": self.requests,
+                    "mean": self.total_seconds / self.requests,
+                    "p50": float(np.percentile(recent, 50)),
+                    "p95": float(np.percentile(recent, 95)),
+                    "max": self.max_seconds,
+                    "concurrency": int(self.limit.limit)}
+
+    def log_summary(self):
+        """Log the latency statistics."""
+        stats = self.summary()
+        if stats["requests"]:
+            logging.debug("Epidata: {requests} requests, latency mean "
+                          "{mean:.3f}s, p50 {p50:.3f}s, p95 {p95:.3f}s, max "
+                          "{max:.3f}s, concurrency {concurrency}".format(
+                              **stats))
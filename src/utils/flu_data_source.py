@@ -7,22 +7,35 @@ https://github.com/cmu-delphi/
 ===============
 
 A wrapper for the Epidata API as used for nowcasting. Caching is used
-extensively to reduce the number of requests made to the API.
+extensively to reduce the number of requests made to the API: fetched values
+are kept in a ColumnStore, and derived results in bounded method caches (see
+bounded_cache.py, which also provides `invalidate` and `cache_stats`).
 """
 
 # standard
 import abc
 import functools
+import itertools
+import logging
+import threading
 
 # third party
 import numpy as np
 
 # first party
 from src.operations import secrets
+from src.utils.bounded_cache import cached_method, invalidate
+from src.utils.column_store import ColumnStore
 from src.utils.delphi_epidata import Epidata
+from src.utils.epidata_arrays import align, fluview_arrays, sensor_arrays
 from src.utils.epidate import EpiDate
 from src.utils.epiweek import add_epiweeks, range_epiweeks
+from src.utils.fetch_planner import MAX_ROWS, compact_epiweeks, plan
+from src.utils.fetcher import Fetcher
 from src.utils.geo.locations import Locations
+from src.utils.metrics import metrics
+from src.utils.single_flight import InFlight
+from src.utils.vintage_store import VintageStore
 
 
 class DataSource(abc.ABC):
@@ -56,6 +69,75 @@ class DataSource(abc.ABC):
     def get_sensor_value(self, epiweek, location, name):
         """Return a sensor reading."""
 
+    def prefetch(self, epiweeks, inputs=(), locations=()):
+        """Load sensor readings and ground truth ahead of use, if useful."""
+
+    def get_truth_values(self, epiweeks, location):
+        """Return multiple ground truth (w)ILI."""
+        return [self.get_truth_value(week, location) for week in epiweeks]
+
+    def get_sensor_values(self, epiweeks, location, name):
+        """Return multiple sensor readings."""
+        return [self.get_sensor_value(week, location, name)
+                for week in epiweeks]
+
+    def get_truth_matrix(self, epiweeks, locations):
+        """Return ground truth as a (weeks x locations) array, NaN if missing."""
+        values = np.full((len(epiweeks), len(locations)), np.nan)
+        for col, loc in enumerate(locations):
+            values[:, col] = self.get_truth_values(tuple(epiweeks), loc)
+        return values
+
+    def get_sensor_matrix(self, epiweeks, inputs):
+        """Return (sensor, location) readings as a (weeks x inputs) array."""
+        values = np.full((len(epiweeks), len(inputs)), np.nan)
+        for col, (name, loc) in enumerate(inputs):
+            values[:, col] = self.get_sensor_values(tuple(epiweeks), loc, name)
+        return values
+
+    def get_reporting_mask(self, epiweeks, atoms=None):
+        """Return which atoms reported on each week, for a range at once.
+
+        Like get_missing_locations, weeks on which no atom reported (such as
+        future weeks) are assumed to have all atoms reporting.
+
+        Args:
+            epiweeks: epiweeks (rows) of the mask
+            atoms: atoms (columns) of the mask, by default all atoms
+
+        Returns:
+            a (weeks x atoms) boolean array
+        """
+        atoms = Locations.atom_list if atoms is None else atoms
+        reported = np.isfinite(self.get_truth_matrix(epiweeks, atoms))
+        reported[~np.any(reported, axis=1)] = True
+        return reported
+
+    def get_missing_patterns(self, epiweeks, atoms=None):
+        """Return the distinct sets of missing atoms over a range of weeks.
+
+        Returns:
+            a list of tuples of atoms which did not report, one per distinct
+            pattern, and an array giving the pattern of each epiweek
+        """
+        atoms = Locations.atom_list if atoms is None else atoms
+        reported = self.get_reporting_mask(epiweeks, atoms)
+        if not len(epiweeks):
+            return [], np.zeros(0, dtype=int)
+        patterns, index = np.unique(reported, axis=0, return_inverse=True)
+        missing = [tuple(itertools.compress(atoms, ~row)) for row in patterns]
+        return missing, index.reshape(-1)
+
+    def get_truth_matrix_as_of(self, issue, epiweeks, locations):
+        """Return ground truth as published up to an issue, NaN if missing.
+
+        Sources without a revision history return the final values of the
+        weeks up to the issue.
+        """
+        values = self.get_truth_matrix(epiweeks, locations)
+        unpublished = np.asarray(epiweeks)[:, None] > np.asarray(issue)
+        return np.where(unpublished, np.nan, values)
+
 
 class FluDataSource(DataSource):
     """The interface by which all input data is provided."""
@@ -66,55 +148,62 @@ class FluDataSource(DataSource):
     # all known sensors, past and present
     SENSORS = ['gft', 'ght', 'twtr', 'wiki', 'cdc', 'epic', 'sar3', 'arch']
 
+    # recent weeks whose values may still be revised by a new issue
+    REVISION_WEEKS = 10
+
+    # largest number of weeks a fluview issue publishes for one location
+    ISSUE_WEEKS = 53
+
     @staticmethod
     def new_instance():
         return FluDataSource(
             Epidata, FluDataSource.SENSORS, Locations.region_list)
 
-    def __init__(self, epidata, sensors, locations):
+    def __init__(self, epidata, sensors, locations, cache_dir=None,
+                 max_concurrency=1):
         self.epidata = epidata
         self.sensors = sensors
         self.sensor_locations = locations
 
-        # cache for prefetching bulk flu data
-        self.cache = {}
+        # runs bulk requests, up to max_concurrency at a time
+        self.fetcher = Fetcher(max_concurrency)
+        # requests in flight, shared by all threads using this data source
+        self.in_flight = InFlight()
+
+        # cache for prefetching bulk flu data, by (signal, location, week),
+        # persisted in cache_dir (if given) across processes and runs
+        self.cache_dir = cache_dir
+        if cache_dir is None:
+            self.cache = ColumnStore()
+        else:
+            self.cache = ColumnStore.load(cache_dir)
+
+        # ground truth as published in every issue, for as-of queries
+        self.vintages = VintageStore()
+        self._vintages_lock = threading.Lock()
 
-    @functools.lru_cache(maxsize=1)
     def get_truth_locations(self):
         """Return a list of locations in which ground truth is available."""
         return Locations.region_list
 
-    @functools.lru_cache(maxsize=1)
     def get_sensor_locations(self):
         """Return a list of locations in which sensors are available."""
         return self.sensor_locations
 
-    @functools.lru_cache(maxsize=None)
+    @cached_method(maxsize=1024)
     def get_missing_locations(self, epiweek):
         """Return a tuple of locations which did not report on the given week."""
 
-        # only return missing atoms, i.e. locations that can't be further split
-        atomic_locations = set(Locations.atom_list)
+        # only return missing atoms, i.e. locations that can't be further split;
+        # all atoms are fetched at once (see get_reporting_mask)
+        reported = self.get_reporting_mask([epiweek])[0]
+        return tuple(itertools.compress(Locations.atom_list, ~reported))
 
-        available_locations = []
-        for loc in atomic_locations:
-            if self.get_truth_value(epiweek, loc) is None:
-                # this atomic location didn't report (or it's a future week)
-                continue
-            available_locations.append(loc)
-
-        if available_locations:
-            return tuple(atomic_locations - set(available_locations))
-        else:
-            # no data is available, assume that all locations will be reporting
-            return ()
-
-    @functools.lru_cache(maxsize=1)
     def get_sensors(self):
         """Return a list of sensor names."""
         return self.sensors
 
-    @functools.lru_cache(maxsize=1)
+    @cached_method(maxsize=1, ttl=3600)  # a new issue appears every week
     def get_weeks(self):
         """Return a list of weeks on which truth and sensors are both available."""
         latest_week = self.get_most_recent_issue()
@@ -126,95 +215,303 @@ class FluDataSource(DataSource):
         """Return ground truth (w)ILI."""
 
         try:
-            return self.cache['ilinet'][location][epiweek]
+            value = self.cache.get('ilinet', location, epiweek)
+            metrics.count('get_truth_value.hit')
+            return value
         except KeyError:
-            # print('cache miss: get_truth_value', epiweek, location)
-            auth = secrets.api.fluview
-            response = self.epidata.fluview(location, epiweek, auth=auth)
-            if response['result'] != 1:
-                return self.add_to_cache('ilinet', location, epiweek, None)
-            data = response['epidata'][0]
-            if data['num_providers'] == 0:
-                return self.add_to_cache('ilinet', location, epiweek, None)
-            return self.add_to_cache('ilinet', location, epiweek, data['wili'])
-
-    @functools.lru_cache(maxsize=None)
+            metrics.count('get_truth_value.miss')
+            self.prefetch([epiweek], locations=[location])
+            return self.read('ilinet', location, [epiweek])[0]
+
     def get_truth_values(self, epiweeks, location):
         """Return multiple ground truth (w)ILI."""
         try:
-            return [self.cache['ilinet'][location][week] for week in epiweeks]
+            values = self.cache.get_many('ilinet', location, epiweeks)
+            metrics.count('get_truth_values.hit')
+            return values
         except KeyError:
-            auth = secrets.api.fluview
-            response = self.epidata.fluview(location, epiweeks, auth=auth)
-            if response['result'] != 1:
-                return [self.add_to_cache('ilinet', location, week, None) for
-                        week in epiweeks]
-
-            valid_weeks = []
-            for row in response['epidata']:
-                valid_weeks.append(row['epiweek'])
-            valid_weeks = np.array(valid_weeks)
-
-            values = []
-            for week in epiweeks:
-                idx = list(np.where(valid_weeks == week))[0]
-                if len(idx) > 0:
-                    row = response['epidata'][idx[0]]
-                    if row['num_providers'] == 0:
-                        values.append(self.add_to_cache('ilinet', location,
-                                                        row['epiweek'], None))
-                        continue
-                    values.append(
-                        self.add_to_cache('ilinet', location, row['epiweek'],
-                                          row['wili']))
-                else:
-                    values.append(
-                        self.add_to_cache('ilinet', location, week, None))
-
-        return values
+            metrics.count('get_truth_values.miss')
+            self.prefetch(epiweeks, locations=[location])
+            return self.read('ilinet', location, epiweeks)
 
-    @functools.lru_cache(maxsize=None)
     def get_sensor_value(self, epiweek, location, name):
         """Return a sensor reading."""
         try:
-            return self.cache[name][location][epiweek]
+            value = self.cache.get(name, location, epiweek)
+            metrics.count('get_sensor_value.hit')
+            return value
         except KeyError:
-            # print('cache miss: get_sensor_value', epiweek, location, name)
-            response = self.epidata.sensors(
-                secrets.api.sensors, name, location, epiweek)
-            if response['result'] != 1:
-                return self.add_to_cache(name, location, epiweek, None)
-            value = response['epidata'][0]['value']
-            return self.add_to_cache(name, location, epiweek, value)
-
-    @functools.lru_cache(maxsize=None)
+            metrics.count('get_sensor_value.miss')
+            self.prefetch([epiweek], inputs=[(name, location)])
+            return self.read(name, location, [epiweek])[0]
+
     def get_sensor_values(self, epiweeks, location, name):
         """Return multiple sensor readings."""
         try:
-            return [self.cache[name][location][week] for week in epiweeks]
+            values = self.cache.get_many(name, location, epiweeks)
+            metrics.count('get_sensor_values.hit')
+            return values
         except KeyError:
-            response = self.epidata.sensors(secrets.api.sensors, name, location,
-                                            epiweeks)
-            if response['result'] != 1:
-                return [self.add_to_cache(name, location, week, None) for week
-                        in epiweeks]
-            valid_weeks = []
-            for row in response['epidata']:
-                valid_weeks.append(row['epiweek'])
-            valid_weeks = np.array(valid_weeks)
-            values = []
-            for week in epiweeks:
-                idx = list(np.where(valid_weeks == week))[0]
-                if len(idx) > 0:
-                    values.append(self.add_to_cache(name, location, week,
-                                                    response['epidata'][idx[0]][
-                                                        'value']))
-                else:
-                    values.append(self.add_to_cache(name, location, week, None))
+            metrics.count('get_sensor_values.miss')
+            self.prefetch(epiweeks, inputs=[(name, location)])
+            return self.read(name, location, epiweeks)
+
+    def read(self, name, location, epiweeks):
+        """Return cached values as a list, None where not available."""
+        values = self.cache.matrix([(name, location)], epiweeks)[0][:, 0]
+        return [None if np.isnan(v) else float(v) for v in values]
+
+    def get_truth_matrix(self, epiweeks, locations):
+        """Return ground truth as a (weeks x locations) array, NaN if missing.
+
+        Cached columns are read in one slice of the store; the others are
+        fetched first, in as few requests as possible.
+        """
+        columns = [('ilinet', loc) for loc in locations]
+        values, known = self.cache.matrix(columns, epiweeks)
+        missing = np.flatnonzero(~np.all(known, axis=0))
+        metrics.count('get_truth_matrix.hit', len(columns) - len(missing))
+        metrics.count('get_truth_matrix.miss', len(missing))
+        if len(missing):
+            self.prefetch(epiweeks, locations=[locations[c] for c in missing])
+            values = self.cache.matrix(columns, epiweeks)[0]
+        return values
 
+    def get_sensor_matrix(self, epiweeks, inputs):
+        """Return (sensor, location) readings as a (weeks x inputs) array.
+
+        Cached columns are read in one slice of the store; the others are
+        fetched first, in as few requests as possible.
+        """
+        values, known = self.cache.matrix(inputs, epiweeks)
+        missing = np.flatnonzero(~np.all(known, axis=0))
+        metrics.count('get_sensor_matrix.hit', len(inputs) - len(missing))
+        metrics.count('get_sensor_matrix.miss', len(missing))
+        if len(missing):
+            self.prefetch(epiweeks, inputs=[inputs[c] for c in missing])
+            values = self.cache.matrix(inputs, epiweeks)[0]
         return values
 
-    @functools.lru_cache(maxsize=1)
+    def get_truth_matrix_as_of(self, issue, epiweeks, locations):
+        """Return ground truth as published up to an issue, NaN if missing.
+
+        Unlike get_truth_matrix, which returns the latest (finalized) values,
+        every value is the one of the latest issue at or before `issue`, as
+        needed for honest retrospective backtests.
+
+        Args:
+            issue: issue, or an array of issues broadcastable to the matrix
+            epiweeks: epiweeks (rows) of the matrix
+            locations: locations (columns) of the matrix
+
+        Returns:
+            a (weeks x locations) array
+        """
+        self.load_vintages(min(epiweeks), int(np.max(issue)), locations)
+        return self.vintages.as_of(issue, epiweeks, locations)
+
+    def load_vintages(self, first_epiweek, last_issue, locations):
+        """Fetch ground truth of all issues up to last_issue, for as-of queries.
+
+        Issues held already are not fetched again.
+
+        Args:
+            first_epiweek: first epiweek wanted
+            last_issue: last issue wanted
+            locations: locations of ground truth wanted
+        """
+        with self._vintages_lock:
+            groups = self.vintages.missing(locations, first_epiweek, last_issue)
+            n_missing = sum(len(missing) for missing, _, _ in groups)
+            metrics.count('load_vintages.hit', len(locations) - n_missing)
+            metrics.count('load_vintages.miss', n_missing)
+
+            # each group is fetched, and marked covered, for its own epiweeks
+            # and issues
+            for missing, first_week, first_issue in groups:
+                # requests are split by issue, each returning up to
+                # ISSUE_WEEKS rows per location and issue
+                issues = range_epiweeks(first_issue, last_issue,
+                                        inclusive=True)
+                columns = [('ilinet', loc) for loc in missing]
+                calls = [functools.partial(
+                    self.epidata.fluview, locs,
+                    self.epidata.range(first_week, last_issue),
+                    issues=compact_epiweeks(part), auth=secrets.api.fluview,
+                    columnar=True) for _, locs, part
+                    in plan(columns, issues, MAX_ROWS // self.ISSUE_WEEKS)]
+                metrics.count('load_vintages.requests', len(calls))
+
+                complete = True
+                for _, response in self.fetcher.run(calls):
+                    if self.has_data(response) or response['result'] == 2:
+                        self.vintages.add_arrays(
+                            fluview_arrays(response['epidata']))
+                    complete = complete and response['result'] != 2
+                self.fetcher.log_summary()
+                if complete:
+                    self.vintages.set_covered(missing, first_week, last_issue)
+                else:
+                    logging.warning(f"Truncated Epidata response for issues "
+                                    f"{first_issue}-{last_issue} in "
+                                    f"{missing}.")
+
+    def prefetch(self, epiweeks, inputs=(), locations=()):
+        """Fetch sensor readings and ground truth into the cache.
+
+        Values that are cached already are skipped, values that another
+        thread is fetching are waited for (see single_flight.py), and the rest
+        is fetched in as few requests as possible (see fetch_planner.py).
+
+        Args:
+            epiweeks: epiweeks to fetch
+            inputs: (sensor name, location) pairs of sensor readings to fetch
+            locations: locations of ground truth to fetch
+        """
+        columns = list(inputs) + [('ilinet', loc) for loc in locations]
+        known = self.cache.matrix(columns, epiweeks)[1]
+        wanted = {}
+        for col in np.flatnonzero(~np.all(known, axis=0)):
+            wanted[columns[col]] = [week for week, k in
+                                    zip(epiweeks, known[:, col]) if not k]
+
+        self.fetch_wanted(wanted)
+
+    def sync(self, first_epiweek, inputs=(), locations=(),
+             revision_weeks=REVISION_WEEKS):
+        """Bring cached columns up to date with the most recent issue.
+
+        Only the weeks after the last value held in a column (or the issue it
+        was last synced to, if later) are fetched, together with the
+        `revision_weeks` before them, which may have been revised since.
+        Columns without any cached value are fetched from `first_epiweek`.
+
+        Args:
+            first_epiweek: first epiweek of columns fetched in full
+            inputs: (sensor name, location) pairs of sensor readings to sync
+            locations: locations of ground truth to sync
+            revision_weeks: number of held weeks to fetch again
+
+        Returns:
+            the number of columns that were synced
+        """
+        issue = self.get_most_recent_issue()
+        columns = list(inputs) + [('ilinet', loc) for loc in locations]
+        last_weeks = self.cache.last_weeks(columns)
+        wanted = {}
+        for column, last_week in zip(columns, last_weeks):
+            synced = self.cache.issues.get(column)
+            if synced == issue:
+                continue
+            held = [week for week in (last_week, synced) if week is not None]
+            first = first_epiweek
+            if held:
+                first = max(first, add_epiweeks(max(held), 1 - revision_weeks))
+            wanted[column] = list(range_epiweeks(first, issue, inclusive=True))
+
+        requests = self.fetcher.requests
+        self.fetch_wanted(wanted)
+        self.cache.set_issue(wanted, issue)
+        if wanted:
+            invalidate(self, 'get_missing_locations')
+        logging.info(f"Synced {len(wanted)} of {len(columns)} columns to "
+                     f"issue {issue} in "
+                     f"{self.fetcher.requests - requests} requests.")
+        return len(wanted)
+
+    def fetch_wanted(self, wanted):
+        """Fetch the wanted cells, cached or not, unless another thread is.
+
+        Args:
+            wanted: dict mapping (signal, location) columns to epiweeks
+        """
+        flight, claimed, waits = self.in_flight.claim(wanted)
+        metrics.count('prefetch.coalesced', len(wanted) - len(claimed))
+        try:
+            self.fetch(claimed)
+        except Exception as e:
+            self.in_flight.land(flight, claimed, e)
+            raise
+        self.in_flight.land(flight, claimed)
+        for other in waits:
+            other.wait()
+
+    def fetch(self, claimed):
+        """Fetch the given epiweeks of the given columns into the cache.
+
+        Args:
+            claimed: dict mapping (signal, location) columns to epiweeks
+        """
+        # columns wanted on the same weeks are planned together
+        by_weeks = {}
+        for column, weeks in claimed.items():
+            by_weeks.setdefault(tuple(weeks), []).append(column)
+
+        requests = []
+        for epiweeks, columns in by_weeks.items():
+            inputs = [c for c in columns if c[0] != 'ilinet']
+            for names, locs, weeks in plan(inputs, epiweeks):
+                requests.append((functools.partial(
+                    self.epidata.sensors, secrets.api.sensors, names, locs,
+                    compact_epiweeks(weeks), columnar=True), names, locs,
+                    weeks, sensor_arrays))
+            truths = [c for c in columns if c[0] == 'ilinet']
+            for names, locs, weeks in plan(truths, epiweeks):
+                requests.append((functools.partial(
+                    self.epidata.fluview, locs, compact_epiweeks(weeks),
+                    auth=secrets.api.fluview, columnar=True), names, locs,
+                    weeks, fluview_arrays))
+        if not requests:
+            return
+        metrics.count('prefetch.requests', len(requests))
+
+        # requests run concurrently, responses are stored here one at a time
+        calls = [request[0] for request in requests]
+        for i, response in self.fetcher.run(calls):
+            self.store_response(response, *requests[i][1:])
+        self.fetcher.log_summary()
+
+    def has_data(self, response):
+        """Return whether an Epidata response has data.
+
+        Requests that failed (even after retries) raise an Exception instead
+        of being treated as missing data, so that no None is cached for them.
+        """
+        if Epidata.is_transient(response):
+            metrics.count('epidata.failed')
+            Epidata.check(response)
+        return response['result'] == 1
+
+    def store_response(self, response, names, locations, epiweeks, decode):
+        """Add the values of a multi-name, multi-location response to the cache.
+
+        Args:
+            response: Epidata response
+            names: names (signals) requested
+            locations: locations requested
+            epiweeks: epiweeks requested
+            decode: function turning the rows into arrays (epidata_arrays.py)
+        """
+        rows = []
+        if self.has_data(response) or response['result'] == 2:
+            rows = response['epidata']
+        arrays = decode(rows)
+        columns = [(name, loc) for name in names for loc in locations]
+        values, found = align(arrays, columns, epiweeks,
+                              None if 'name' in arrays else names[0])
+
+        # a truncated response (result 2) says nothing about the rows it lacks
+        complete = response['result'] != 2
+        if not complete:
+            logging.warning(f"Truncated Epidata response for {names} in "
+                            f"{locations}; missing values are not cached.")
+        epiweeks = np.asarray(epiweeks)
+        for col, (name, loc) in enumerate(columns):
+            rows = slice(None) if complete else found[:, col]
+            self.multi_add_to_cache(
+                name, loc, epiweeks[rows].tolist(), values[rows, col])
+
+    @cached_method(maxsize=1, ttl=3600)
     def get_most_recent_issue(self):
         """Return the most recent epiweek for which FluView data is available."""
         ew2 = EpiDate.today().get_ew()
@@ -223,20 +520,16 @@ class FluDataSource(DataSource):
         issues = [row['issue'] for row in self.epidata.check(response)]
         return max(issues)
 
+    def save_cache(self):
+        """Save newly fetched values to the cache directory, if any."""
+        if self.cache_dir is not None and self.cache.modified:
+            self.cache.save(self.cache_dir)
+
     def multi_add_to_cache(self, name, location, epiweeks, values):
         """Add mulitple epiweek values to the cache."""
-        if name not in self.cache:
-            self.cache[name] = {}
-        if location not in self.cache[name]:
-            self.cache[name][location] = {}
-        for week, value in zip(epiweeks, values):
-            self.cache[name][location][week] = value
+        self.cache.put(name, location, epiweeks, values)
 
     def add_to_cache(self, name, location, epiweek, value):
         """Add the given value to the cache."""
-        if name not in self.cache:
-            self.cache[name] = {}
-        if location not in self.cache[name]:
-            self.cache[name][location] = {}
-        self.cache[name][location][epiweek] = value
+        self.cache.put(name, location, [epiweek], [value])
         return value
@@ -0,0 +1,198 @@
+"""
+Purpose: Measure the memory used by pool tasks and keep a run within a budget.
+
+Every task submitted through `BudgetedPool` runs inside `tracked_call`, which
+measures the peak resident set size (RSS) of the worker during the task and,
+optionally, the peak of Python allocations (tracemalloc, which slows Python
+code down noticeably and is therefore opt-in).
+
+Given a memory budget, `BudgetedPool` bounds the summed RSS of the parent and
+all its child processes (the pool workers, idle or not, including pages they
+kept from earlier tasks). Before starting a task, it samples that sum and
+holds the task back unless every running task, plus the new one, could still
+grow its worker by the largest growth observed so far. Until a first task has
+been measured, tasks run one at a time.
+
+The budget can only be kept by running fewer tasks: a single task larger than
+the budget still runs, and workers that alone exceed it are only reported.
+RSS counts pages shared between processes once per process, so the sum errs
+on the high side.
+"""
+
+# standard
+import functools
+import logging
+import multiprocessing
+import os
+import resource
+import threading
+import tracemalloc
+from collections import deque
+from concurrent.futures import Future
+
+# first party
+from src.utils.metrics import metrics
+
+
+def current_rss(pid="self"):
+    """Return the current resident set size of a process in bytes.
+
+    Args:
+        pid: process id, by default this process
+
+    Returns:
+        the RSS, or 0 for a process that has exited (and, without /proc, the
+        peak RSS of this process)
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss() if pid == "self" else 0
+
+
+def total_rss():
+    """Return the summed RSS of this process and all its child processes."""
+    return current_rss() + sum(current_rss(p.pid)
+                               for p in multiprocessing.active_children())
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """Reset the peak RSS to the current RSS, if the OS supports it.
+
+    Returns:
+        whether the peak was reset; if not, it covers the whole life of the
+        process
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def tracked_call(func, args, track_allocations=False):
+    """Run func(*args), returning the result, the peak RSS, how far the RSS
+    rose above its level at the start, and the peak allocations."""
+    reset_peak_rss()
+    start = current_rss()
+    if track_allocations:
+        tracemalloc.start()
+    try:
+        result = func(*args)
+    finally:
+        allocated = None
+        if track_allocations:
+            allocated = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    peak = peak_rss()
+    return result, peak, max(0, peak - start), allocated
+
+
+class BudgetedPool:
+    """Wraps a multiprocessing pool, limiting concurrency to a memory budget.
+
+    Args:
+        pool: the multiprocessing pool
+        n_workers: number of workers of the pool
+        limit: budget for the summed RSS of the parent and all its child
+            processes in bytes, or None
+        track_allocations: also record the peak Python allocations of tasks
+    """
+
+    def __init__(self, pool, n_workers, limit=None, track_allocations=False):
+        self.pool = pool
+        self.n_workers = n_workers
+        self.limit = limit
+        self.track_allocations = track_allocations
+
+        self.task_growth = None  # largest RSS growth of a task observed
+        self.running = 0
+        self._warned = False
+        self.queue = deque()
+        self._lock = threading.Lock()
+
+    def capacity(self):
+        """Return how many tasks may currently run at once."""
+        if self.limit is None:
+            return self.n_workers
+        if self.task_growth is None:
+            return 1
+        free = self.limit - total_rss()
+        if free < 0 and not self._warned:
+            self._warned = True
+            logging.warning(f"The run uses {(self.limit - free) / 2 ** 20:.0f}"
+                            f"MB, more than its memory budget; running one "
+                            f"task at a time.")
+        return max(1, min(self.n_workers,
+                          int(free // max(1, self.task_growth))))
+
+    def apply_async(self, func, args=(), callback=None):
+        """Submit func(*args), returning a Future of its result.
+
+        `callback` is called with the result as soon as the task finishes
+        (from the pool's result thread, like multiprocessing's callbacks).
+        """
+        future = Future()
+        with self._lock:
+            self.queue.append((func, args, callback, future))
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+        """Start queued tasks while there is room in the budget.
+
+        Without a budget, every task goes to the pool's own queue at once.
+        """
+        while True:
+            with self._lock:
+                if not self.queue or (self.limit is not None and
+                                      self.running >= self.capacity()):
+                    return
+                func, args, callback, future = self.queue.popleft()
+                self.running += 1
+            self.pool.apply_async(
+                tracked_call, args=(func, args, self.track_allocations),
+                callback=functools.partial(self._done, func, callback, future),
+                error_callback=functools.partial(self._failed, future))
+
+    def _done(self, func, callback, future, res):
+        result, rss, growth, allocated = res
+        metrics.peak(f"rss.{func.__name__}", rss)
+        if allocated is not None:
+            metrics.peak(f"py_alloc.{func.__name__}", allocated)
+
+        with self._lock:
+            self.running -= 1
+            if self.task_growth is None or growth > self.task_growth:
+                self.task_growth = growth
+                if self.limit is not None:
+                    logging.info(f"Largest task growth is now "
+                                 f"{growth / 2 ** 20:.0f}MB; running up to "
+                                 f"{self.capacity()} tasks.")
+        try:
+            if callback is not None:
+                callback(result)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+        self._dispatch()
+
+    def _failed(self, future, exc):
+        with self._lock:
+            self.running -= 1
+        future.set_exception(exc)
+        self._dispatch()
@@ -0,0 +1,166 @@
+"""
+Purpose: Collect timings and counters for the hot paths of a simulation run.
+
+Instrumented code uses the module-level `metrics` object:
+
+    with metrics.timer("get_training_data"):
+        ...
+    metrics.count("get_truth_value.hit")
+    metrics.peak("rss.cv", rss_bytes)
+
+Collection is disabled by default. A disabled `timer` returns a shared no-op
+context manager and `count` returns immediately, so the instrumentation costs
+one attribute check per call.
+
+Pool workers collect into their own copy; task functions return
+`metrics.drain()` with their result and the parent merges it back.
+"""
+
+# standard
+import functools
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+_NULL_TIMER = nullcontext()
+
+
+class _Timer:
+    """Context manager recording wall and CPU time under a name."""
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.wall,
+                            time.process_time() - self.cpu)
+
+
+class Metrics:
+    """Named timers (calls, wall and CPU seconds), counters and peaks."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.timings = {}  # name -> [calls, wall, cpu]
+        self.counters = {}  # name -> count
+        self.peaks = {}  # name -> largest value seen
+        self._lock = threading.Lock()
+
+    def timer(self, name):
+        """Return a context manager timing its body under `name`."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def timed(self, name):
+        """Decorator timing every call of the function under `name`."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name, wall, cpu=0.0, calls=1):
+        """Add a measurement to the timer `name`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += calls
+            timing[1] += wall
+            timing[2] += cpu
+
+    def count(self, name, n=1):
+        """Increment the counter `name`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def peak(self, name, value):
+        """Keep the largest value reported under `name` (e.g. memory)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.peaks[name] = max(self.peaks.get(name, value), value)
+
+    def drain(self):
+        """Return all measurements as a plain dict and reset them."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            snapshot = {"timings": self.timings, "counters": self.counters,
+                        "peaks": self.peaks}
+            self.timings, self.counters, self.peaks = {}, {}, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add the measurements of a drained snapshot (e.g. from a worker)."""
+        if not snapshot:
+            return
+        for name, (calls, wall, cpu) in snapshot["timings"].items():
+            self.record(name, wall, cpu, calls)
+        for name, n in snapshot["counters"].items():
+            self.count(name, n)
+        for name, value in snapshot["peaks"].items():
+            self.peak(name, value)
+
+    def to_jsonl(self, **labels):
+        """Return the measurements as JSON lines, one per timer/counter."""
+        lines = []
+        for name, (calls, wall, cpu) in sorted(self.timings.items()):
+            lines.append(json.dumps(dict(
+                labels, type="timer", name=name, calls=calls, wall=wall,
+                cpu=cpu)))
+        for name, n in sorted(self.counters.items()):
+            lines.append(json.dumps(dict(
+                labels, type="counter", name=name, count=n)))
+        for name, value in sorted(self.peaks.items()):
+            lines.append(json.dumps(dict(
+                labels, type="peak", name=name, value=value)))
+        return "".join(line + "\n" for line in lines)
+
+    def to_prometheus(self, prefix="nowcast", **labels):
+        """Return the measurements in the Prometheus text exposition format."""
+        def line(metric, name, value):
+            tags = dict(labels, name=name)
+            tags = ",".join(f'{k}="{v}"' for k, v in sorted(tags.items()))
+            return f"{prefix}_{metric}{{{tags}}} {value}\n"
+
+        text = []
+        for metric, column in [("calls_total", 0), ("wall_seconds_total", 1),
+                               ("cpu_seconds_total", 2)]:
+            text.append(f"# TYPE {prefix}_{metric} counter\n")
+            for name, timing in sorted(self.timings.items()):
+                text.append(line(metric, name, timing[column]))
+        text.append(f"# TYPE {prefix}_events_total counter\n")
+        for name, n in sorted(self.counters.items()):
+            text.append(line("events_total", name, n))
+        text.append(f"# TYPE {prefix}_peak gauge\n")
+        for name, value in sorted(self.peaks.items()):
+            text.append(line("peak", name, value))
+        return "".join(text)
+
+    def write(self, path, fmt="jsonl", **labels):
+        """Write the measurements to `path` as "jsonl" or "prometheus"."""
+        if fmt == "jsonl":
+            text = self.to_jsonl(**labels)
+        elif fmt == "prometheus":
+            text = self.to_prometheus(**labels)
+        else:
+            raise Exception(f"unknown metrics format: {fmt}")
+        with open(path, "w") as f:
+            f.write(text)
+
+
+# metrics of the current process
+metrics = Metrics()
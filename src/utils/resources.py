@@ -0,0 +1,91 @@
+"""
+Purpose: Split a global core budget across pool workers.
+
+Every pool worker runs Gurobi, NumPy (BLAS) and scikit-learn, each of which
+starts as many threads as there are cores by default. With several workers on
+one machine this oversubscribes the CPU. The budget fixes the number of threads
+every task may use, and derives the number of concurrent workers from it.
+"""
+
+# standard
+import logging
+import os
+from multiprocessing import cpu_count
+
+# environment variables read by the common BLAS/OpenMP implementations
+BLAS_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                 "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+
+class ThreadBudget:
+    """Trade per-task parallelism against task-level parallelism.
+
+    Args:
+        n_cores: total number of cores to use (default: all cores)
+        threads_per_task: threads given to the solver, BLAS and sklearn inside
+            a single task. Larger values mean fewer concurrent workers.
+            (default: spread the cores evenly over `max_workers` workers)
+        max_workers: upper bound on the number of concurrent workers
+    """
+
+    def __init__(self, n_cores=None, threads_per_task=None, max_workers=None):
+        self.n_cores = max(1, min(n_cores or cpu_count(), cpu_count()))
+        if threads_per_task is None:
+            threads_per_task = self.n_cores // (max_workers or self.n_cores)
+        self.threads_per_task = max(1, min(threads_per_task, self.n_cores))
+
+        n_workers = max(1, self.n_cores // self.threads_per_task)
+        if max_workers is not None:
+            n_workers = min(n_workers, max_workers)
+        self.n_workers = n_workers
+
+    def __repr__(self):
+        return (f"ThreadBudget(n_cores={self.n_cores}, n_workers="
+                f"{self.n_workers}, threads_per_task={self.threads_per_task})")
+
+    @property
+    def solver_threads(self):
+        """Value of the Gurobi `Threads` parameter."""
+        return self.threads_per_task
+
+    @property
+    def blas_threads(self):
+        """Thread limit for NumPy's BLAS backend."""
+        return self.threads_per_task
+
+    @property
+    def n_jobs(self):
+        """Value of scikit-learn's `n_jobs`."""
+        return self.threads_per_task
+
+    def apply(self):
+        """Limit the thread pools of the current process to the budget."""
+        for var in BLAS_ENV_VARS:
+            os.environ[var] = str(self.blas_threads)
+
+        # BLAS is already loaded at this point, so environment variables alone
+        # are not enough; threadpoolctl resizes the running pools if present
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            logging.debug("threadpoolctl not available, BLAS threads are only"
+                          " limited through environment variables")
+        else:
+            threadpool_limits(limits=self.blas_threads)
+
+
+# budget of the current process (a single task using all cores by default),
+# replaced by `init_worker` in pool workers
+_budget = ThreadBudget(max_workers=1)
+
+
+def get_budget():
+    """Return the thread budget of the current process."""
+    return _budget
+
+
+def init_worker(budget):
+    """Install and apply the budget in this process (pool initializer)."""
+    global _budget
+    _budget = budget
+    _budget.apply()
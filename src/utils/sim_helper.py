@@ -29,14 +29,16 @@ def mean_impute(a):
     return a
 
 
-def cache(ds, sensors=SENSORS, max_ew=MAX_CACHE_EPIWEEK):
+def cache(ds, sensors=SENSORS, max_ew=MAX_CACHE_EPIWEEK, regions=REGION_LIST):
     """Cache sensor and wILI values beforehand.
 
     Note this fits SF on finalized wILI. In practice, wILI values are often
-    revised and this caching procedure is not possible.
+    revised and this caching procedure is not possible; see
+    `FluDataSource.get_truth_matrix_as_of` for the values as published.
     """
-    inputs = list(itertools.product(sensors, REGION_LIST))
+    inputs = list(itertools.product(sensors, regions))
     cache_weeks = list(range_epiweeks(FIRST_EPIWEEK, max_ew, inclusive=False))
+    ds.prefetch(cache_weeks, inputs, regions)  # batched, where supported
     for col, (sen, loc) in enumerate(inputs):
         ds.get_sensor_values(tuple(cache_weeks), loc, sen)
         ds.get_truth_values(tuple(cache_weeks), loc)
@@ -0,0 +1,74 @@
+"""
+Purpose: Collapse concurrent requests for the same data into one request.
+
+Callers claim the (column, week) cells they are about to fetch, where a
+column is a (signal, location) pair. Cells that another caller is already
+fetching are not claimed again; instead, the caller waits for that flight to
+land and then reads the cells from the cache. A failed flight passes its
+exception on to every waiter.
+"""
+
+# standard
+import threading
+
+
+class Flight:
+    """One outstanding request, which waiters can block on."""
+
+    def __init__(self):
+        self.error = None
+        self._done = threading.Event()
+
+    def land(self, error=None):
+        """Mark the request as finished (successfully if error is None)."""
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        """Block until the request finished, re-raising its error."""
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class InFlight:
+    """Table of the cells that are being fetched, by column."""
+
+    def __init__(self):
+        self.flights = {}  # column -> list of (frozenset of weeks, Flight)
+        self._lock = threading.Lock()
+
+    def claim(self, wanted):
+        """Claim the cells that nobody is fetching yet.
+
+        Args:
+            wanted: dict mapping columns to the epiweeks wanted in them
+
+        Returns:
+            a new Flight, the claimed cells (dict mapping columns to epiweeks)
+            to fetch under it and the set of other Flights to wait for
+        """
+        flight, claimed, waits = Flight(), {}, set()
+        with self._lock:
+            for column, weeks in wanted.items():
+                weeks = set(weeks)
+                for other_weeks, other in self.flights.get(column, []):
+                    if weeks & other_weeks:
+                        waits.add(other)
+                        weeks -= other_weeks
+                if weeks:
+                    claimed[column] = sorted(weeks)
+                    self.flights.setdefault(column, []).append(
+                        (frozenset(weeks), flight))
+        return flight, claimed, waits
+
+    def land(self, flight, claimed, error=None):
+        """Remove the claimed cells from the table and wake up the waiters."""
+        with self._lock:
+            for column in claimed:
+                self.flights[column] = [(weeks, other) for weeks, other
+                                        in self.flights[column]
+                                        if other is not flight]
+                if not self.flights[column]:
+                    del self.flights[column]
+        flight.land(error)
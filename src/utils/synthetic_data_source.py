@@ -0,0 +1,147 @@
+"""
+Purpose: An offline DataSource serving synthetic wILI and sensor readings.
+
+The data mimics the structure of the Delphi data behind FluDataSource:
+
+  - every atom has its own seasonal wILI curve (peak week, height and baseline
+    vary by atom and season) plus autocorrelated noise;
+  - regional wILI is the population-weighted average of the atoms reporting
+    that week, so the hierarchy in Locations is respected exactly;
+  - each sensor is a noisy, biased and scaled copy of the wILI of its location,
+    only available in a subset of locations, starting at a random week, and
+    with randomly missing weeks. The first sensor is complete, so that every
+    atom stays observable (and the statespace is all atoms);
+  - atoms occasionally do not report, in which case their truth is None.
+
+All values are generated once from a seed, so every instance with the same
+arguments serves identical data.
+"""
+
+# third party
+import numpy as np
+
+# first party
+from src.utils.epiweek import range_epiweeks, split_epiweek
+from src.utils.flu_data_source import DataSource, FluDataSource
+from src.utils.geo.locations import Locations
+from src.utils.geo.populations import get_population
+
+
+class SyntheticDataSource(DataSource):
+    """Synthetic stand-in for FluDataSource, without network access."""
+
+    def __init__(self, sensors, locations, last_epiweek=201920,
+                 exclude_locations=(), sensor_coverage=0.8,
+                 p_missing_sensor=0.05, p_missing_truth=0.01, seed=0):
+        """
+        Args:
+            sensors: list of sensor names
+            locations: locations in which sensors may be available
+            last_epiweek: last epiweek with data (inclusive)
+            exclude_locations: atoms without any data
+            sensor_coverage: probability that a sensor covers a location
+            p_missing_sensor: probability that a sensor reading is missing
+            p_missing_truth: probability that an atom does not report
+            seed: seed of the generated data
+        """
+        self.sensors = list(sensors)
+        self.sensor_locations = list(locations)
+        self.weeks = list(range_epiweeks(
+            FluDataSource.FIRST_DATA_EPIWEEK, last_epiweek, inclusive=True))
+        self.week_index = {week: i for i, week in enumerate(self.weeks)}
+
+        rng = np.random.RandomState(seed)
+        self.atoms = [a for a in Locations.atom_list
+                      if a not in exclude_locations]
+        atom_wili = self._atom_wili(rng)
+        reporting = rng.rand(*atom_wili.shape) >= p_missing_truth
+
+        # truth by location, nan where the location did not report
+        self.truth = {}
+        populations = np.array([get_population(a) for a in self.atoms])
+        for loc in Locations.region_list:
+            members = [i for i, a in enumerate(self.atoms)
+                       if a in Locations.region_map[loc]]
+            if not members:
+                continue
+            weights = populations[members] * reporting[:, members]
+            total = weights.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = (atom_wili[:, members] * weights).sum(axis=1) / total
+            self.truth[loc] = np.where(total > 0, values, np.nan)
+
+        # sensors by (name, location)
+        self.readings = {}
+        n_weeks = len(self.weeks)
+        for i, name in enumerate(self.sensors):
+            gain, bias, noise = 1 + 0.2 * rng.randn(), rng.randn(), rng.rand()
+            for loc in self.sensor_locations:
+                if loc not in self.truth:
+                    continue
+                values = gain * self.truth[loc] + bias + \
+                    noise * rng.randn(n_weeks)
+                if i > 0:
+                    if rng.rand() >= sensor_coverage:
+                        continue
+                    values[:rng.randint(n_weeks // 4)] = np.nan  # late start
+                    values[rng.rand(n_weeks) < p_missing_sensor] = np.nan
+                self.readings[(name, loc)] = values
+
+    def _atom_wili(self, rng):
+        """Return seasonal wILI curves (weeks x atoms)."""
+        n_weeks, n_atoms = len(self.weeks), len(self.atoms)
+        week_of_year = np.array([split_epiweek(w)[1] for w in self.weeks])
+        season_week = (week_of_year - 40) % 52  # weeks since epiweek 40
+        season = np.cumsum(season_week == 0)
+
+        baseline = rng.lognormal(0, 0.3, n_atoms)
+        n_seasons = season[-1] + 1
+        height = rng.lognormal(1, 0.4, (n_seasons, n_atoms))
+        peak = 18 + 4 * rng.randn(n_seasons, n_atoms)
+        width = 4 + rng.rand(n_seasons, n_atoms) * 3
+
+        curve = baseline + height[season] * np.exp(
+            -((season_week[:, None] - peak[season]) / width[season]) ** 2)
+
+        # AR(1) noise
+        noise = np.zeros((n_weeks, n_atoms))
+        shocks = 0.1 * rng.randn(n_weeks, n_atoms)
+        for i in range(1, n_weeks):
+            noise[i] = 0.7 * noise[i - 1] + shocks[i]
+        return np.maximum(curve + noise, 0)
+
+    def _lookup(self, series, epiweek):
+        i = self.week_index.get(epiweek)
+        if series is None or i is None or np.isnan(series[i]):
+            return None
+        return float(series[i])
+
+    def get_truth_locations(self):
+        """Return a list of locations in which ground truth is available."""
+        return list(self.truth)
+
+    def get_sensor_locations(self):
+        """Return a list of locations in which sensors are available."""
+        return self.sensor_locations
+
+    def get_missing_locations(self, epiweek):
+        """Return a tuple of locations which did not report on the given week."""
+        missing = tuple(a for a in self.atoms
+                        if self.get_truth_value(epiweek, a) is None)
+        return () if len(missing) == len(self.atoms) else missing
+
+    def get_sensors(self):
+        """Return a list of sensor names."""
+        return self.sensors
+
+    def get_weeks(self):
+        """Return a list of weeks on which truth and sensors are both available."""
+        return self.weeks
+
+    def get_truth_value(self, epiweek, location):
+        """Return ground truth (w)ILI."""
+        return self._lookup(self.truth.get(location), epiweek)
+
+    def get_sensor_value(self, epiweek, location, name):
+        """Return a sensor reading."""
+        return self._lookup(self.readings.get((name, location)), epiweek)
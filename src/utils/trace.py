@@ -0,0 +1,105 @@
+"""
+Purpose: Record a timeline of pool tasks and main-process stages.
+
+Spans are stored as Chrome trace "complete" events (one per task or stage,
+with the process and thread that ran it), and written as a JSON trace file
+that chrome://tracing and https://ui.perfetto.dev can open. Gaps between the
+spans of a worker show where it sat idle.
+
+Like `metrics`, tracing is off by default, in which case `span` returns a
+shared no-op context manager. Pool workers return `tracer.drain()` with each
+task result and the parent merges the events.
+"""
+
+# standard
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+_NULL_SPAN = nullcontext()
+
+
+def _now():
+    """Return a timestamp in microseconds, comparable across processes."""
+    return time.time_ns() // 1000
+
+
+class _Span:
+    """Context manager recording one complete event."""
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.event = {"name": name, "cat": cat, "ph": "X", "args": args}
+
+    def __enter__(self):
+        self.event["ts"] = _now()
+        return self
+
+    def __exit__(self, *exc):
+        self.event["dur"] = _now() - self.event["ts"]
+        self.event["pid"] = os.getpid()
+        self.event["tid"] = threading.get_ident()
+        self.tracer.add(self.event)
+
+
+class Tracer:
+    """Collects trace events of the current process."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+
+    def span(self, name, cat="stage", **args):
+        """Return a context manager recording its body as one event.
+
+        Args:
+            name: event name shown on the timeline
+            cat: event category, e.g. "task" (pool) or "stage" (main process)
+            **args: task identity, shown when the event is selected
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def traced(self, name, cat="stage"):
+        """Decorator recording every call of the function as one event."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, cat):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add(self, event):
+        """Append a finished event (list.append is thread-safe)."""
+        self.events.append(event)
+
+    def drain(self):
+        """Return the recorded events and reset them."""
+        if not self.enabled:
+            return None
+        events, self.events = self.events, []
+        return events
+
+    def merge(self, events):
+        """Add events drained in another process."""
+        if events:
+            self.events.extend(events)
+
+    def write(self, path):
+        """Write all events as a Chrome/Perfetto JSON trace."""
+        main = os.getpid()
+        names = [{"name": "process_name", "ph": "M", "pid": pid,
+                  "args": {"name": "main" if pid == main else f"worker {pid}"}}
+                 for pid in sorted({event["pid"] for event in self.events})]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": names + self.events,
+                       "displayTimeUnit": "ms"}, f)
+
+
+# tracer of the current process
+tracer = Tracer()
@@ -0,0 +1,135 @@
+"""
+Purpose: Assemble the training data of a whole season at once.
+
+Consecutive nowcasts train on windows of the same history that differ by one
+week. A TrainingHistory fetches the aligned sensor and ground truth history
+once, as two (weeks x columns) arrays, and hands out the window of each week
+as slices of them, without copying. The statistics needed to impute a window
+(column means and which columns have data) are computed once per window and
+cached.
+
+Windows are views: they must not be written to. `impute` returns imputed
+copies instead.
+
+Out of core, the history is written to .npy files in a directory and
+memory-mapped, so that windows are slices of the mapped files and only the
+pages in use are read. Assembling the history and computing its statistics
+work in chunks of at most `chunk_bytes`, so the whole history is never held
+in memory at once. This bounds the memory of the history only: an imputed
+training window is still a full in-memory copy, which is sent to every pool
+task that uses it.
+"""
+
+# standard
+import os
+import warnings
+
+# third party
+import numpy as np
+
+# first party
+from src.utils.bounded_cache import cached_method
+from src.utils.epiweek import range_epiweeks
+
+
+def impute(values, means):
+    """Return a copy of the values with NaNs replaced by the column means."""
+    return np.where(np.isnan(values), means, values)
+
+
+# largest chunk of the history processed at once, out of core
+CHUNK_BYTES = 64 * 2 ** 20
+
+
+class TrainingHistory:
+    """Aligned sensor readings and ground truth, from first to last epiweek.
+
+    Args:
+        ds: DataSource providing the values
+        first_epiweek: first epiweek of the history
+        last_epiweek: last epiweek of the history (inclusive)
+        inputs: (sensor name, location) pairs, the columns of `sensors`
+        atoms: locations of ground truth, the columns of `truth`
+        directory: directory of the memory-mapped history (None: in memory)
+        chunk_bytes: largest chunk of the history processed at once
+    """
+
+    def __init__(self, ds, first_epiweek, last_epiweek, inputs, atoms,
+                 directory=None, chunk_bytes=CHUNK_BYTES):
+        self.weeks = list(range_epiweeks(first_epiweek, last_epiweek,
+                                         inclusive=True))
+        self.week_index = {week: i for i, week in enumerate(self.weeks)}
+        self.inputs = list(inputs)
+        self.atoms = list(atoms)
+        self.chunk_bytes = chunk_bytes
+        if directory is None:
+            self.sensors = ds.get_sensor_matrix(self.weeks, self.inputs)
+            self.truth = ds.get_truth_matrix(self.weeks, self.atoms)
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.sensors = self._assemble(
+                os.path.join(directory, "sensors.npy"), len(self.inputs),
+                lambda weeks: ds.get_sensor_matrix(weeks, self.inputs))
+            self.truth = self._assemble(
+                os.path.join(directory, "truth.npy"), len(self.atoms),
+                lambda weeks: ds.get_truth_matrix(weeks, self.atoms))
+
+    def _chunks(self, n, size):
+        """Split range(n) into slices of at most chunk_bytes, where every item
+        takes `size` floats."""
+        step = max(1, self.chunk_bytes // (8 * max(1, size)))
+        return [slice(i, min(i + step, n)) for i in range(0, n, step)]
+
+    def _assemble(self, path, n_columns, get_matrix):
+        """Write a (weeks x columns) matrix to a .npy file in chunks of weeks,
+        and return it memory-mapped (read-only)."""
+        values = np.lib.format.open_memmap(
+            path, mode="w+", shape=(len(self.weeks), n_columns))
+        for rows in self._chunks(len(self.weeks), n_columns):
+            values[rows] = get_matrix(self.weeks[rows])
+        values.flush()
+        del values
+        return np.load(path, mmap_mode="r")
+
+    def rows(self, epiweek, n_train_weeks):
+        """Return the slice of the training weeks of an epiweek."""
+        end = self.week_index[epiweek]
+        return slice(max(0, end - n_train_weeks), end)
+
+    def window(self, epiweek, n_train_weeks):
+        """Return views of the data for nowcasting an epiweek.
+
+        Returns:
+            the weeks, sensor readings and ground truth of the (at most
+            n_train_weeks) training weeks before the epiweek, and the readings
+            of the epiweek itself as a (1 x inputs) array
+        """
+        rows = self.rows(epiweek, n_train_weeks)
+        end = rows.stop
+        return (self.weeks[rows], self.sensors[rows], self.truth[rows],
+                self.sensors[end:end + 1])
+
+    @cached_method(maxsize=256)
+    def stats(self, epiweek, n_train_weeks):
+        """Return the imputation statistics of a training window.
+
+        Returns:
+            the column means of the sensor readings and of the ground truth
+            (NaN for columns without data), and a boolean array marking the
+            sensor columns with any data
+        """
+        rows = self.rows(epiweek, n_train_weeks)
+        n_rows = rows.stop - rows.start
+        sensor_means = np.empty(len(self.inputs))
+        finite = np.empty(len(self.inputs), dtype=bool)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # empty columns
+            # column-major, like the column selection of get_training_data,
+            # so that the means are summed in the same order
+            for cols in self._chunks(len(self.inputs), n_rows):
+                block = np.asfortranarray(self.sensors[rows, cols])
+                sensor_means[cols] = np.nanmean(block, axis=0)
+                finite[cols] = np.any(np.isfinite(block), axis=0)
+            # the few atoms are summed row by row, like mean_impute does
+            truth_means = np.nanmean(self.truth[rows], axis=0)
+        return sensor_means, truth_means, finite
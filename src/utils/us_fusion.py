@@ -294,4 +294,4 @@ class UsFusion:
             output_locations = [all_locations[i] for i in selected_rows]
 
         # convert fractions to floats and return the result
-        return H.astype(np.float), W.astype(np.float), output_locations
+        return H.astype(float), W.astype(float), output_locations
@@ -0,0 +1,132 @@
+"""
+Purpose: A bitemporal store of wILI values by (location, epiweek, issue).
+
+FluView values of recent weeks are revised in later issues, so the value of a
+week depends on when it is looked at. The store keeps every published value
+with the issue it appeared in, and answers "what was known as of issue W"
+for a whole (weeks x locations) matrix at once.
+
+Rows are kept in arrays sorted by one int64 key combining location, epiweek
+and issue, so that the latest value of each cell published at or before W is
+found with a single searchsorted over all cells of the matrix. Rows are
+appended cheaply and sorted once, on the first query after them.
+"""
+
+# standard
+import threading
+
+# third party
+import numpy as np
+
+# first party
+from src.utils.epiweek import add_epiweeks
+
+# key = (location code * SCALE + epiweek) * SCALE + issue, both below SCALE
+SCALE = 10 ** 6
+
+
+class VintageStore:
+    """Published values by (location, epiweek, issue)."""
+
+    def __init__(self):
+        self.locations = {}  # location -> code
+        self.covered = {}  # location -> (first epiweek, last issue) held
+        self.keys = np.zeros(0, dtype=np.int64)  # sorted
+        self.values = np.zeros(0)
+        self._pending = []  # (keys, values) added since the last sort
+        self._lock = threading.Lock()
+
+    def _cells(self, locations, epiweeks):
+        """Return the location-epiweek part of the keys."""
+        codes = np.array([self.locations.get(loc, -1) for loc in locations],
+                         dtype=np.int64)
+        return codes * SCALE + np.asarray(epiweeks, dtype=np.int64)
+
+    def add(self, locations, epiweeks, issues, values):
+        """Add published values (NaN if not available).
+
+        A value added again for the same location, epiweek and issue replaces
+        the earlier one.
+        """
+        with self._lock:
+            for loc in locations:
+                self.locations.setdefault(loc, len(self.locations))
+            keys = self._cells(locations, epiweeks) * SCALE + \
+                np.asarray(issues, dtype=np.int64)
+            self._pending.append((keys, np.array(values, dtype=float)))
+
+    def add_arrays(self, arrays):
+        """Add the rows of a decoded fluview response (epidata_arrays.py)."""
+        self.add(arrays["location"], arrays["epiweek"], arrays["issue"],
+                 arrays["value"])
+
+    def set_covered(self, locations, first_epiweek, last_issue):
+        """Record that all values of the locations are held for the epiweeks
+        from first_epiweek, as published up to last_issue."""
+        with self._lock:
+            for loc in locations:
+                self.covered[loc] = (first_epiweek, last_issue)
+
+    def missing(self, locations, first_epiweek, last_issue):
+        """Return what must be fetched to cover the locations.
+
+        Locations needing the same epiweeks and issues are grouped, so that
+        each group can be fetched, and then marked covered, on its own.
+
+        Returns:
+            a list of (locations, first epiweek, first issue) to fetch, up to
+            last_issue
+        """
+        groups = {}
+        for loc in locations:
+            first, last = self.covered.get(loc, (None, None))
+            if first is None or first > first_epiweek:
+                # issues before the first epiweek publish none of its weeks
+                key = (first_epiweek, first_epiweek)
+            elif last < last_issue:
+                # only the new issues, for all weeks held so far
+                key = (first, add_epiweeks(last, 1))
+            else:
+                continue
+            groups.setdefault(key, []).append(loc)
+        return [(locs, first_week, first_issue)
+                for (first_week, first_issue), locs in groups.items()]
+
+    def _sort(self):
+        """Merge pending rows into the sorted arrays."""
+        if not self._pending:
+            return
+        keys = np.concatenate([self.keys] + [k for k, _ in self._pending])
+        values = np.concatenate([self.values] + [v for _, v in self._pending])
+        # stable, so that the last of equal keys is the one added last
+        order = np.argsort(keys, kind="stable")
+        keys, values = keys[order], values[order]
+        last = np.append(keys[1:] != keys[:-1], True)
+        self.keys, self.values = keys[last], values[last]
+        self._pending = []
+
+    def as_of(self, issue, epiweeks, locations):
+        """Return the values known as of an issue.
+
+        Args:
+            issue: issue, or an array of issues broadcastable to the matrix
+                (for instance one per epiweek, shaped (weeks, 1))
+            epiweeks: epiweeks (rows) of the matrix
+            locations: locations (columns) of the matrix
+
+        Returns:
+            a (weeks x locations) float array holding, for every cell, the
+            value of the latest issue at or before `issue`; NaN if none
+        """
+        with self._lock:
+            self._sort()
+            keys, values = self.keys, self.values
+        shape = (len(epiweeks), len(locations))
+        if not len(keys):
+            return np.full(shape, np.nan)
+
+        cells = self._cells(locations, np.asarray(epiweeks)[:, None])
+        targets = cells * SCALE + np.asarray(issue, dtype=np.int64)
+        pos = np.searchsorted(keys, targets, side="right") - 1
+        found = np.logical_and(pos >= 0, keys[pos] // SCALE == cells)
+        return np.where(found, values[pos], np.nan)